@@ -0,0 +1,229 @@
+import queue
+import threading
+import numpy as np
+
+from pattern import LOCKS
+
+
+class BankSet(object):
+    """Pattern banks, the bank chain (song) and their prepared tables.
+
+    The playing bank lives in the sequencer's `Pattern` and is copied back
+    when switching away. Output and LED tables of upcoming banks are built
+    by `build_tables(data, locks)` on a worker thread, a switch only swaps
+    them in on the bar boundary.
+
+    Banks can read from outside views, i.e.: `PatternLibrary` slots, see
+    `attach`. Those are only copied when the bank plays, and the copy is
+    kept in memory from then on.
+    """
+
+    def __init__(self, nof_banks, nof_tracks, nof_steps, build_tables):
+        self.nof_banks = nof_banks
+        self.data = np.zeros(
+            (nof_banks, nof_tracks, nof_steps), dtype=np.uint8
+        )
+        self.locks = {
+            name: np.full(
+                (nof_banks, nof_tracks, nof_steps), default, dtype=dtype
+            )
+            for name, (dtype, default) in LOCKS.items()
+        }
+        # bank -> (data, locks) views it reads from until written
+        self.sources = {}
+        self.current = 0
+        # bank queued for the next bar, before the song
+        self.next = None
+        # the playing bank is queued with a new pattern, see `queue`
+        self.reload = False
+        self.tables = {}
+        self._build_tables = build_tables
+        self._generation = 0
+        self._prepare_queue = None
+        # False builds upcoming tables inline, i.e.: for offline renders
+        self.prepare_async = True
+        self.song = []
+        self.song_loop = True
+        self._song_entry = 0
+        self._song_bars_left = 0
+
+    def get_data(self, index):
+        source = self.sources.get(index, None)
+        return self.data[index] if source is None else source[0]
+
+    def get_locks(self, index):
+        source = self.sources.get(index, None)
+        if source is not None:
+            return source[1]
+
+        return {name: lock[index] for name, lock in self.locks.items()}
+
+    def attach(self, index, data, locks=None):
+        """Read bank `index` from `data` and `locks` views, nothing copied.
+
+        Missing `locks` read as their defaults.
+        """
+        locks = dict(locks or {})
+        for name, (dtype, default) in LOCKS.items():
+            if name not in locks:
+                locks[name] = np.full(np.shape(data), default, dtype=dtype)
+
+        self.sources[index] = (data, locks)
+        self.tables.pop(index, None)
+
+    def write(self, index, data, locks=None):
+        """Copy a pattern in bank `index`, tables are left as they are"""
+        source = self.sources.pop(index, None)
+        if source is not None and locks is None:
+            locks = source[1]
+
+        self.data[index] = data
+        for name, values in (locks or {}).items():
+            self.locks[name][index] = values
+
+    def store(self, index, data, locks=None):
+        self.write(index, data, locks)
+        self.tables.pop(index, None)
+        if index == self.upcoming():
+            self.prepare(index)
+
+    def queue(self, index, data=None, locks=None):
+        """Switch to bank `index` on the next bar.
+
+        With `data` (and `locks`), i.e.: a `PatternLibrary` slot, the bank
+        is attached to it first, the playing bank reloads from it.
+        """
+        if not 0 <= index < self.nof_banks:
+            raise IndexError(f"No bank {index}, nof_banks {self.nof_banks}")
+
+        if data is not None:
+            self.attach(index, data, locks)
+
+        self.reload = data is not None and index == self.current
+        self.prepare(index)
+        self.next = index
+
+    def set_song(self, song, loop=True):
+        """Chain `[(bank, repeats), ...]`, from the next bar or start"""
+        self.song = [(int(bank), int(repeats)) for bank, repeats in song]
+        self.song_loop = loop
+        # the first entry comes in on the next bar
+        self._song_entry = -1
+        self._song_bars_left = 1
+        for bank, _ in self.song:
+            self.prepare(bank)
+
+    def _next_song_entry(self):
+        entry = self._song_entry + 1
+        if entry >= len(self.song):
+            return 0 if self.song_loop else None
+
+        return entry
+
+    def upcoming(self):
+        """Bank playing on the next bar if it differs from this one"""
+        if self.next is not None:
+            return self.next
+
+        if len(self.song) and self._song_bars_left == 1:
+            entry = self._next_song_entry()
+            if entry is not None:
+                return self.song[entry][0]
+
+        return None
+
+    def upcoming_tables(self):
+        """Tables of the bank playing next, None if it is this one"""
+        bank = self.upcoming()
+        if bank is None or (bank == self.current and not self.reload):
+            return None
+
+        return self.tables.get(bank, None)
+
+    def _build(self, index):
+        return self._build_tables(
+            np.array(self.get_data(index)),
+            {
+                name: np.array(lock)
+                for name, lock in self.get_locks(index).items()
+            },
+        )
+
+    def _prepare_worker(self):
+        while True:
+            index, generation = self._prepare_queue.get()
+            if generation == self._generation:
+                tables = self._build(index)
+                if generation == self._generation:
+                    self.tables[index] = tables
+
+    def prepare(self, index):
+        if index is None or (index == self.current and not self.reload):
+            return
+
+        if index in self.tables:
+            return
+
+        if not self.prepare_async:
+            self.tables[index] = self._build(index)
+            return
+
+        if self._prepare_queue is None:
+            self._prepare_queue = queue.Queue()
+            threading.Thread(target=self._prepare_worker, daemon=True).start()
+
+        self._prepare_queue.put((index, self._generation))
+
+    def prepare_upcoming(self):
+        self.prepare(self.upcoming())
+        if len(self.song):
+            entry = self._next_song_entry()
+            if entry is not None:
+                self.prepare(self.song[entry][0])
+
+    def invalidate(self):
+        """Mix, note map or selection changed, rebuild prepared tables"""
+        if not len(self.tables) and self._prepare_queue is None:
+            return
+
+        self._generation += 1
+        self.tables = {}
+        for bank in set([bank for bank, _ in self.song] + [self.upcoming()]):
+            self.prepare(bank)
+
+    def next_bar(self):
+        """Move the song on a bar, return the bank to play on it"""
+        target = self.upcoming()
+        self.next = None
+        if len(self.song):
+            self._song_bars_left -= 1
+            if self._song_bars_left <= 0:
+                entry = self._next_song_entry()
+                if entry is None:
+                    # end of the song, keep playing its last bank
+                    self.song = []
+                else:
+                    self._song_entry = entry
+                    self._song_bars_left = self.song[entry][1]
+
+        return target
+
+    def seek_song(self, bars):
+        """Move the song `bars` bars after its start, return its bank"""
+        total = sum(repeats for _, repeats in self.song)
+        if not self.song_loop and bars >= total:
+            # past the end of the song, keep playing its last bank
+            bank = self.song[-1][0]
+            self.song = []
+            return bank
+
+        bars %= total
+        for entry, (bank, repeats) in enumerate(self.song):
+            if bars < repeats:
+                break
+
+            bars -= repeats
+
+        self._song_entry = entry
+        self._song_bars_left = repeats - bars
+        return bank
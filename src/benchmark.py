@@ -0,0 +1,309 @@
+"""Benchmarks for the tick, input and LED hot paths.
+
+    python benchmark.py --out bench.json
+    python benchmark.py --out new.json --compare bench.json
+
+Each case reports per call times in microseconds. In compare mode, cases
+whose median got slower than `--threshold` percent are flagged and the
+exit status is 1.
+"""
+
+import sys
+import json
+import time
+import argparse
+import threading
+import statistics
+import numpy as np
+
+from rtmidi.midiconstants import NOTE_ON, TIMING_CLOCK
+
+from clock import InternalClock, LedClock
+from latency import probe
+from midi_queue import InputQueue
+from modes import (
+    TrackMode,
+    TrackSelectMode,
+    NoteMode,
+    LedMode,
+    LedColors,
+    QueueBackend,
+)
+from sequencer import Sequencer
+
+
+class NullQueue(object):
+    """Output and led queue stand-in, drops everything"""
+
+    def put(self, messages):
+        pass
+
+    def __call__(self, messages):
+        pass
+
+    def schedule(self, timestamp, messages):
+        pass
+
+
+def bench_config(nof_tracks=8, nof_steps=16):
+    return dict(
+        track_mode=TrackMode.select_tracks,
+        track_select_mode=TrackSelectMode.arrows,
+        note_mode=NoteMode.toggle,
+        input_channel=0,
+        output_channel=0,
+        nof_tracks=nof_tracks,
+        nof_steps=nof_steps,
+        nof_displayed_tracks=1,
+        note_input_map=list(range(nof_steps)),
+        note_output_map=[(35 + i) % 128 for i in range(nof_tracks)],
+        track_select_map=[126, 127],
+        led_config=dict(
+            led_mode=LedMode.handled,
+            led_color_mode=LedColors.default,
+            led_channel=0,
+            led_clock=True,
+        ),
+    )
+
+
+def summary(samples_ns, **params):
+    samples = sorted(samples_ns)
+    return dict(
+        params=params,
+        calls=len(samples),
+        mean_us=statistics.mean(samples) / 1e3,
+        median_us=samples[len(samples) // 2] / 1e3,
+        p99_us=samples[int(len(samples) * 0.99) - 1] / 1e3,
+        max_us=samples[-1] / 1e3,
+    )
+
+
+def timeit(fn, calls):
+    samples = []
+    for _ in range(calls):
+        start = time.perf_counter_ns()
+        fn()
+        samples.append(time.perf_counter_ns() - start)
+
+    return samples
+
+
+def make_sequencer(nof_tracks, nof_steps, density=0.3, **options):
+    config = bench_config(nof_tracks, nof_steps)
+    config.update(options)
+    seq = Sequencer(config, NullQueue(), NullQueue())
+    seq.randomize_pattern(density, rng=np.random.default_rng(0))
+    seq.start()
+    return seq
+
+
+def bench_sequencer_tick(calls):
+    results = {}
+    for nof_tracks in (8, 32, 64):
+        for nof_steps in (16, 64):
+            seq = make_sequencer(nof_tracks, nof_steps)
+            results[f"sequencer_tick[{nof_tracks}x{nof_steps}]"] = summary(
+                timeit(seq.tick, calls),
+                nof_tracks=nof_tracks,
+                nof_steps=nof_steps,
+            )
+
+    return results
+
+
+def bench_sequencer_pulse(calls):
+    """Every step locked: probability, ratchets, micro-timing and gate"""
+    rng = np.random.default_rng(0)
+    results = {}
+    for nof_tracks, nof_steps in ((16, 16), (16, 64)):
+        seq = make_sequencer(nof_tracks, nof_steps, step_locks=True, seed=0)
+        shape = (nof_tracks, nof_steps)
+        seq.load_pattern(seq.pattern.data, dict(
+            probability=rng.integers(0, 101, shape),
+            ratchets=rng.integers(1, 4, shape),
+            micro=rng.integers(-2, 3, shape),
+            gate=rng.integers(1, 12, shape),
+        ))
+        name = f"sequencer_pulse_locks[{nof_tracks}x{nof_steps}]"
+        results[name] = summary(
+            timeit(seq.pulse, calls),
+            nof_tracks=nof_tracks,
+            nof_steps=nof_steps,
+        )
+
+    return results
+
+
+def bench_input_queue(calls, backend, rounds=20):
+    """Pad press to `Sequencer.process` throughput, then its latency.
+
+    Throughput is timed with the latency probe off, one sample per round
+    of `calls / rounds` messages, as time per message.
+    """
+    seq = make_sequencer(8, 16)
+    input_queue = InputQueue(NoteMode.toggle, channel=0, backend=backend)
+    input_queue.add_handler(seq.process)
+    processed = [0]
+    drained = threading.Event()
+    round_calls = max(calls // rounds, 1)
+
+    def count(message):
+        processed[0] += 1
+        if processed[0] == round_calls:
+            drained.set()
+
+    input_queue.add_handler(count)
+    input_queue.start()
+
+    samples = []
+    for _ in range(rounds):
+        processed[0] = 0
+        drained.clear()
+        start = time.perf_counter_ns()
+        for idx in range(round_calls):
+            input_queue(([NOTE_ON, idx % 16, 127], 0.))
+
+        drained.wait()
+        samples.append((time.perf_counter_ns() - start) / round_calls)
+
+    probe.enabled = True
+    probe.histograms = {}
+    for idx in range(calls):
+        input_queue(([NOTE_ON, idx % 16, 127], 0.))
+
+    input_queue.stop()
+    input_queue.join()
+    probe.enabled = False
+
+    latency = probe.histograms["input_sequencer"].as_dict()
+    probe.histograms = {}
+    result = summary(samples, backend=backend.value)
+    result.update(
+        latency_mean_us=latency["mean_us"],
+        latency_max_us=latency["max_us"],
+    )
+    return {f"input_queue[{backend.value}]": result}
+
+
+def bench_track_propagate(calls):
+    seq = make_sequencer(8, 64)
+    track = seq.tracks[0]
+    return {
+        "track_propagate[edit]": summary(
+            timeit(lambda: track.propagate(7), calls), nof_steps=64
+        ),
+        "track_propagate[redraw]": summary(
+            timeit(track.propagate, calls), nof_steps=64
+        ),
+    }
+
+
+def bench_led_clock_tick(calls):
+    config = bench_config(8, 16)
+    seq = make_sequencer(8, 16)
+    led_clock = LedClock(config, seq, NullQueue())
+    return {
+        "led_clock_tick": summary(
+            timeit(led_clock.tick, calls), nof_steps=16
+        ),
+    }
+
+
+def bench_internal_clock(seconds, bpm=180.):
+    """Deviation of the clock pulse intervals from the nominal one"""
+    arrivals = []
+    clock = InternalClock(bpm=bpm)
+    clock.set_callback(
+        lambda message: arrivals.append(time.perf_counter_ns())
+        if message[0] == TIMING_CLOCK else None
+    )
+    clock.start()
+    time.sleep(seconds)
+    clock.stop()
+    stats = clock.stats.as_dict()
+    intervals = np.diff(arrivals)
+    result = summary(
+        np.abs(intervals - clock._tick_ns).tolist(), bpm=bpm, seconds=seconds
+    )
+    result.update(
+        stdev_us=stats["stdev_ms"] * 1e3,
+        dropped=stats["dropped"],
+    )
+    return {"internal_clock_jitter": result}
+
+
+def run(calls, clock_seconds):
+    results = {}
+    results.update(bench_sequencer_tick(calls))
+    results.update(bench_sequencer_pulse(calls))
+    for backend in QueueBackend:
+        results.update(bench_input_queue(calls, backend))
+    results.update(bench_track_propagate(calls))
+    results.update(bench_led_clock_tick(calls))
+    if clock_seconds > 0:
+        results.update(bench_internal_clock(clock_seconds))
+
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Return the cases whose median is `threshold` % slower than before"""
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+
+        before = baseline[name]["median_us"]
+        after = result["median_us"]
+        if before > 0 and (after - before) / before * 100 > threshold:
+            regressions.append((name, before, after))
+
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--out", type=str, default=None)
+    parser.add_argument("--calls", type=int, default=2000)
+    parser.add_argument(
+        "--clock_seconds", type=float, default=2.,
+        help="Internal clock jitter run length, 0 skips it"
+    )
+    parser.add_argument("--compare", type=str, default=None)
+    parser.add_argument(
+        "--threshold", type=float, default=20.,
+        help="Slowdown percentage flagged as regression"
+    )
+    return parser.parse_args()
+
+
+def main(out, calls, clock_seconds, compare_to, threshold):
+    results = run(calls, clock_seconds)
+    for name, result in results.items():
+        print(f"{name:40s} median {result['median_us']:10.2f} us")
+
+    if out is not None:
+        with open(out, "w") as fout:
+            json.dump(results, fout, indent=2)
+
+    if compare_to is not None:
+        baseline = json.load(open(compare_to))
+        regressions = compare(results, baseline, threshold)
+        for name, before, after in regressions:
+            print(
+                f"REGRESSION {name}: {before:.2f} us -> {after:.2f} us "
+                f"(+{(after - before) / before * 100:.0f}%)"
+            )
+
+        if len(regressions):
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    sys.exit(main(
+        args.out, args.calls, args.clock_seconds, args.compare, args.threshold
+    ))
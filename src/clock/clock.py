@@ -1,27 +1,75 @@
+import time
 import logging
 
 from .internal_clock import InternalClock
+from .dispatcher import ClockDispatcher
 from rtmidi.midiconstants import (
-    TIMING_CLOCK, SONG_CONTINUE, SONG_START, SONG_STOP
+    TIMING_CLOCK,
+    SONG_CONTINUE,
+    SONG_START,
+    SONG_STOP,
+    SONG_POSITION_POINTER,
 )
 
-from modes import ClockSource
+from modes import ClockSource, CatchUpPolicy
+from latency import probe
 
 log = logging.getLogger("Midi Clock")
 
+# pulses per MIDI beat (a 16th note), the song position pointer unit
+PULSES_PER_MIDI_BEAT = 6
+
 
 class Clock(object):
-    def __init__(self, clock_source, midiin, bpm=None, signature=4):
+    def __init__(
+        self,
+        clock_source,
+        midiin,
+        bpm=None,
+        signature=4,
+        spin_us=1000,
+        catch_up=CatchUpPolicy.burst,
+        dispatch=False,
+        dispatch_priority=None,
+        realtime=None,
+    ):
         self.clock_source = clock_source
         self.midiin = midiin
         self.bpm = bpm if bpm is not None else 120.0
+        self.spin_us = spin_us
+        self.catch_up = catch_up
+        # RealtimeSettings for the internal clock and dispatch threads, and
+        # what each thread was granted, see `RealtimeSettings.apply`
+        self.realtime = realtime
+        self.realtime_granted = {}
         self.running = False
         self._tickcnt = 0
         self._signature = int((4 / signature) * 24)
+        # clock master: ports every clock message is sent to, see
+        # `add_clock_output`
+        self._clock_outputs = []
+        self._song_pulses = 0
+        # song position handlers resume from, see `_dispatch`
+        self._resume_pulses = 0
 
         self._clock_handlers = []
+        # handlers also called on every 24 PPQN pulse
+        self._pulse_handlers = []
         self._drain_handlers = []
         self._internal_clock = None
+        # jitter of the last internal clock run, see `jitter_stats`
+        self._jitter = None
+        # handlers run on a dispatch thread instead of the clock callback
+        self._dispatcher = None
+        if dispatch:
+            self._dispatcher = ClockDispatcher(
+                self._dispatch, priority=dispatch_priority
+            )
+            self._dispatcher.start()
+            if self.realtime is not None:
+                self.realtime_granted["clock dispatch"] = self.realtime.apply(
+                    self._dispatcher, "clock dispatch"
+                )
 
         if clock_source != ClockSource.internal:
             midiin.ignore_types(timing=False)
@@ -30,39 +78,143 @@ class Clock(object):
             self._create_internal_clock()
 
     def __call__(self, message, data=None):
+        arrival = time.monotonic_ns()
         if isinstance(message, (tuple, list)) and len(message) == 2:
             # skip the timestamp
             message, _ = message
 
         if message[0] == TIMING_CLOCK:
+            # straight out, on the clock source thread
+            self._send_clock([TIMING_CLOCK])
+            self._song_pulses += 1
             if self._tickcnt % self._signature == 0:
-                for clk_hand in self._clock_handlers:
-                    clk_hand.tick()
+                self._emit("tick", arrival)
+
+            if len(self._pulse_handlers):
+                self._emit("pulse", arrival)
 
             self._tickcnt = (self._tickcnt + 1) % self._signature
 
-        elif message[0] in (SONG_CONTINUE, SONG_START):
+        elif message[0] == SONG_START:
             self.running = True
-            log.info("START/CONTINUE received.")
-            for clk_hand in self._clock_handlers:
-                clk_hand.start()
+            log.info("START received.")
+            self._song_pulses = 0
+            self._tickcnt = 0
+            self._send_song_position()
+            self._send_clock([SONG_START])
+            self._emit("start", arrival)
+
+        elif message[0] == SONG_CONTINUE:
+            self.running = True
+            log.info("CONTINUE received.")
+            # on to the next MIDI beat, the position slaves can follow
+            self._song_pulses = -(
+                -self._song_pulses // PULSES_PER_MIDI_BEAT
+            ) * PULSES_PER_MIDI_BEAT
+            # ticks stay on the step grid of the song position
+            self._tickcnt = self._song_pulses % self._signature
+            self._resume_pulses = self._song_pulses
+            self._send_song_position()
+            self._send_clock([SONG_CONTINUE])
+            self._emit("continue", arrival)
 
         elif message[0] == SONG_STOP:
             self.running = False
             self._tickcnt = 0
             log.info("STOP received.")
-            for clk_hand in self._clock_handlers:
-                clk_hand.stop()
+            self._send_clock([SONG_STOP])
+            self._emit("stop", arrival)
 
         else:
+            if message[0] == SONG_POSITION_POINTER:
+                beats = message[1] | (message[2] << 7)
+                self._song_pulses = beats * PULSES_PER_MIDI_BEAT
+                self._send_clock(list(message))
+
             for drain_hand in self._drain_handlers:
                 drain_hand(message, data=data)
 
+    def add_clock_output(self, midiout):
+        """Act as clock master on `midiout`.
+
+        Clock pulses, start, continue and stop go out as soon as the clock
+        source produces them, before any handler runs, so slaves follow the
+        same timebase the sequencer steps are computed from. Starts and
+        continues are preceded by the song position pointer.
+        """
+        self._clock_outputs.append(midiout)
+
+    def _send_clock(self, message):
+        for midiout in self._clock_outputs:
+            midiout.send_message(message)
+
+    def _send_song_position(self):
+        if not len(self._clock_outputs):
+            return
+
+        beats = (self._song_pulses // PULSES_PER_MIDI_BEAT) & 0x3FFF
+        self._send_clock([SONG_POSITION_POINTER, beats & 0x7F, beats >> 7])
+
+    def _emit(self, event, arrival):
+        if self._dispatcher is not None:
+            self._dispatcher.put(event, arrival)
+        else:
+            self._dispatch(event, arrival)
+
+    def _dispatch(self, event, arrival):
+        if event == "tick":
+            if probe.enabled:
+                probe.begin(arrival, "clock")
+
+            late = time.monotonic_ns() - arrival
+            for clk_hand, lateness in self._clock_handlers:
+                if lateness:
+                    clk_hand.tick(late=late)
+                else:
+                    clk_hand.tick()
+
+            if probe.enabled:
+                probe.end()
+
+        elif event == "pulse":
+            late = time.monotonic_ns() - arrival
+            for clk_hand, lateness in self._pulse_handlers:
+                if lateness:
+                    clk_hand.pulse(late=late)
+                else:
+                    clk_hand.pulse()
+
+        elif event == "start":
+            for clk_hand, _ in self._clock_handlers:
+                clk_hand.start()
+
+        elif event == "continue":
+            for clk_hand, _ in self._clock_handlers:
+                if getattr(clk_hand, "resume", None) is not None:
+                    clk_hand.resume(self._resume_pulses)
+                else:
+                    clk_hand.start()
+
+        elif event == "stop":
+            for clk_hand, _ in self._clock_handlers:
+                clk_hand.stop()
+
     def _create_internal_clock(self):
-        self._internal_clock = InternalClock(self.bpm)
+        self._internal_clock = InternalClock(
+            self.bpm, spin_us=self.spin_us, catch_up=self.catch_up
+        )
         self._internal_clock.set_callback(self)
 
-    def add_clock_handler(self, obj):
+    def add_clock_handler(self, obj, lateness=False):
+        """Call `obj.start`, `obj.stop` and `obj.tick` on clock events.
+
+        With `lateness`, ticks are called as `obj.tick(late=ns)` where `ns`
+        is the time elapsed since the clock event arrived. Handlers with a
+        `pulse` method also get it called on every clock pulse, after the
+        tick of the step starting on that pulse. On CONTINUE, handlers with a
+        `resume` method get it called with the song position in pulses, the
+        others get `start` called.
+        """
         attr_fns = ["start", "stop", "tick"]
         for attr in attr_fns:
             if getattr(obj, attr, None) is None:
@@ -71,23 +223,48 @@ class Clock(object):
                     f" {attr_fns}!. {attr} not found"
                 )
 
-        self._clock_handlers.append(obj)
+        self._clock_handlers.append((obj, lateness))
+        if getattr(obj, "pulse", None) is not None:
+            self._pulse_handlers.append((obj, lateness))
 
     def add_drain_handler(self, obj):
         self._drain_handlers.append(obj)
 
-    def start(self):
+    def start(self, resume=False):
+        """Run the internal clock, with `resume` from the song position"""
         self.running = True
         if self.clock_source == ClockSource.internal:
             if self._internal_clock is None:
                 self._create_internal_clock()
 
+            self._internal_clock.resume = resume
             self._internal_clock.start()
+            if self.realtime is not None:
+                self.realtime_granted["internal clock"] = \
+                    self.realtime.apply(self._internal_clock, "internal clock")
+
+    def jitter_stats(self):
+        """Tick lateness statistics of the internal clock, if any.
+
+        Once stopped, the statistics of the last run.
+        """
+        if self._internal_clock is None:
+            return self._jitter
+
+        return self._internal_clock.stats.as_dict()
 
     def stop(self):
         self.running = False
         if self.clock_source == ClockSource.internal:
             if self._internal_clock is not None:
                 self._internal_clock.stop()
+                self._jitter = self.jitter_stats()
+                log.info(f"Internal clock jitter: {self._jitter}")
 
             self._internal_clock = None
+
+    def close(self):
+        """Stop the dispatch thread, if any, once handlers are done"""
+        if self._dispatcher is not None:
+            self._dispatcher.stop()
+            self._dispatcher = None
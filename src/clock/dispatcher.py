@@ -0,0 +1,55 @@
+import os
+import logging
+import threading
+
+from ring_buffer import RingBuffer
+
+
+log = logging.getLogger("Clock Dispatcher")
+
+
+class ClockDispatcher(threading.Thread):
+    """Runs clock handlers on their own thread.
+
+    The clock source (rtmidi callback or internal clock) only enqueues
+    `(event, arrival_ns)` pairs; this thread drains them in order and calls
+    `callback(event, arrival_ns)`. `priority` is the nice value requested for
+    the thread, None keeps the inherited one.
+    """
+
+    def __init__(self, callback, priority=None):
+        super(ClockDispatcher, self).__init__(daemon=True)
+        self.callback = callback
+        self.priority = priority
+        self.queue = RingBuffer()
+
+    def put(self, event, arrival):
+        self.queue.put((event, arrival))
+
+    def stop(self, timeout=5):
+        self.queue.put(None)
+        if self.is_alive():
+            self.join(timeout)
+
+    def _set_priority(self):
+        if self.priority is None or not hasattr(os, "setpriority"):
+            return
+
+        try:
+            os.setpriority(
+                os.PRIO_PROCESS, threading.get_native_id(), self.priority
+            )
+            log.info(f"Clock dispatch thread running at nice {self.priority}")
+        except OSError as err:
+            log.warning(
+                f"Could not set clock dispatch nice {self.priority}: {err}"
+            )
+
+    def run(self):
+        self._set_priority()
+        while True:
+            for item in self.queue.drain():
+                if item is None:
+                    return
+
+                self.callback(*item)
@@ -15,16 +15,87 @@ import threading
 
 from rtmidi.midiconstants import (
     TIMING_CLOCK,
+    SONG_CONTINUE,
     SONG_START,
     SONG_STOP
 )
 
+from modes import CatchUpPolicy
+from realtime import wait_until
+
 
 log = logging.getLogger("CLOCK")
 
 
+class JitterStats(object):
+    """Running statistics of tick lateness against the scheduled deadline.
+
+    All values are kept in nanoseconds, `as_dict` reports milliseconds.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.dropped = 0
+        self.min = None
+        self.max = None
+        self._mean = 0.0
+        self._m2 = 0.0
+
+    def add(self, lateness):
+        self.count += 1
+        if self.min is None or lateness < self.min:
+            self.min = lateness
+        if self.max is None or lateness > self.max:
+            self.max = lateness
+
+        # Welford's online mean/variance
+        delta = lateness - self._mean
+        self._mean += delta / self.count
+        self._m2 += delta * (lateness - self._mean)
+
+    @property
+    def mean(self):
+        return self._mean
+
+    @property
+    def stdev(self):
+        if self.count < 2:
+            return 0.0
+        return (self._m2 / (self.count - 1)) ** 0.5
+
+    def as_dict(self):
+        to_ms = 1e-6
+        return dict(
+            count=self.count,
+            dropped=self.dropped,
+            min_ms=(self.min or 0) * to_ms,
+            max_ms=(self.max or 0) * to_ms,
+            mean_ms=self.mean * to_ms,
+            stdev_ms=self.stdev * to_ms,
+        )
+
+
 class InternalClock(threading.Thread):
-    def __init__(self, bpm=120.0, ppqn=24):
+    """MIDI clock generator scheduled on absolute monotonic deadlines.
+
+    Each tick has a deadline `start + n * tick`, so the time spent in the
+    callback never accumulates into tempo drift, and wall clock adjustments
+    do not affect it. The thread sleeps until `spin_us` before the deadline
+    and busy-waits the remaining stretch. When the callback overruns one or
+    more ticks, `catch_up` decides whether the missed ticks are sent in a
+    burst or dropped.
+    """
+
+    def __init__(
+        self,
+        bpm=120.0,
+        ppqn=24,
+        spin_us=1000,
+        catch_up=CatchUpPolicy.burst,
+    ):
         super(InternalClock, self).__init__()
         self._stopped = threading.Event()
         self._finished = threading.Event()
@@ -33,8 +104,14 @@ class InternalClock(threading.Thread):
 
         # run-time options
         self._tick = None
+        self._tick_ns = None
         self.ppqn = ppqn
         self.bpm = bpm
+        self.spin_ns = int(spin_us * 1000)
+        self.catch_up = CatchUpPolicy(catch_up)
+        self.stats = JitterStats()
+        # send CONTINUE instead of START, playing on from the song position
+        self.resume = False
 
     @property
     def bpm(self):
@@ -44,6 +121,7 @@ class InternalClock(threading.Thread):
     def bpm(self, value):
         self._bpm = value
         self._tick = 60. / (value * self.ppqn)
+        self._tick_ns = int(round(self._tick * 1e9))
         # log.debug("Changed BPM => %s, tick interval %.2f ms.",
         #           self._bpm, self._tick * 1000)
 
@@ -61,17 +139,25 @@ class InternalClock(threading.Thread):
         self.join()
 
     def run(self):
-        self._callback([SONG_START])
+        self.stats.reset()
+        self._callback([SONG_CONTINUE if self.resume else SONG_START])
+        deadline = time.monotonic_ns()
         while not self._stopped.is_set():
-            curtime = time.time()
+            # coarse sleep wakes up early on stop
+            wait_until(deadline, self.spin_ns, self._stopped.wait)
+            if self._stopped.is_set():
+                break
 
+            self.stats.add(time.monotonic_ns() - deadline)
             self._callback([TIMING_CLOCK])
-
-            # loop speed adjustment
-            elapsed = time.time() - curtime
-
-            if elapsed < self._tick:
-                time.sleep(self._tick - elapsed)
+            deadline += self._tick_ns
+
+            late = time.monotonic_ns() - deadline
+            if late >= self._tick_ns and self.catch_up == CatchUpPolicy.skip:
+                # realign to the grid, dropping the ticks already missed
+                missed = late // self._tick_ns
+                deadline += missed * self._tick_ns
+                self.stats.dropped += missed
 
         # log.debug("Midi output mainloop exited.")
         self._finished.set()
@@ -20,6 +20,10 @@ class LedClock(object):
         self.note_map = config["note_input_map"]
         self.sequencer = sequencer
         self._current_beat = 0
+        # polymetric tracks move on pulses, see `pulse`
+        self.polymetric = getattr(sequencer, "polymetric", False)
+        # polymetric tracks: step lit on each track
+        self._lit = {}
 
     def msg_from_tick_track(self, tick, track_id, vel_id, msg_on=True):
         note_id = (track_id * self.nof_steps) + tick
@@ -33,19 +37,33 @@ class LedClock(object):
             velocity=velocity,
         )
 
-    def tick(self):
+    def _track_steps(self, track_id):
+        """Step to light on `track_id` and the one lit before, if any"""
+        if self.polymetric:
+            current = self.sequencer.track_step(track_id)
+            prev = self._lit.get(track_id, None)
+            self._lit[track_id] = current
+            return current, prev
+
+        return self._current_beat, (self._current_beat - 1) % self.nof_steps
+
+    def _update(self):
         messages = []
         for track_id in range(self.nof_displayed_tracks):
             target_track_id = track_id + self.sequencer._display_index
-            prev_tick = (self._current_beat - 1) % self.nof_steps
+            current, prev_tick = self._track_steps(target_track_id)
+            if current == prev_tick:
+                # slower track, still on the same step
+                continue
+
             track_state = self.sequencer.get_track_state(target_track_id)
-            if track_state[self._current_beat] == 0:
+            if track_state[current] == 0:
                 on_msg = self.msg_from_tick_track(
-                    self._current_beat, track_id, target_track_id
+                    current, track_id, target_track_id
                 )
                 messages.append(on_msg.bytes())
 
-            if track_state[prev_tick] == 0:
+            if prev_tick is not None and track_state[prev_tick] == 0:
                 off_msg = self.msg_from_tick_track(
                     prev_tick, track_id, target_track_id, False
                 )
@@ -56,10 +74,28 @@ class LedClock(object):
         if len(messages) > 0:
             self.led_queue(messages)
 
+    def tick(self):
+        if not self.polymetric:
+            self._update()
+
         self._current_beat = (self._current_beat + 1) % self.nof_steps
 
+    def pulse(self):
+        """Polymetric tracks change step on any pulse, not only on ticks"""
+        if self.polymetric:
+            self._update()
+
     def start(self):
         self._current_beat = 0
+        self._lit = {}
+
+    def resume(self, song_pulses):
+        """Playhead on the step the sequencer resumes on"""
+        step_pulses = self.sequencer.step_pulses
+        offset = song_pulses % (step_pulses * self.nof_steps)
+        self._current_beat = -(-offset // step_pulses) % self.nof_steps
+        self._lit = {}
 
     def stop(self):
         self._current_beat = 0
+        self._lit = {}
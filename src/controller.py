@@ -1,7 +1,7 @@
 import mido
 
 from pathlib import Path
-from rtmidi.midiutil import open_midiinput, open_midioutput
+from ports import RtMidiBackend
 
 
 def controller_name_from_port(portname):
@@ -15,13 +15,20 @@ def search_controller_config(portname):
     return Path("controllers").joinpath(conf_name)
 
 
-def flush_controller(ctrl_or_midiout):
+def flush_controller(ctrl_or_midiout, led_sysex=None, notes=None):
     if isinstance(ctrl_or_midiout, dict):
         midiout = ctrl_or_midiout["output_port"]
     else:
         midiout = ctrl_or_midiout
 
-    for i in range(127):
+    notes = range(127) if notes is None else notes
+    if led_sysex is not None:
+        # bulk light off, one write per SysEx frame
+        for message in led_sysex.pack([(note, 0) for note in notes]):
+            midiout.send_message(message)
+        return
+
+    for i in notes:
         message = mido.Message(type="note_off", note=i, velocity=0)
         midiout.send_message(message.bytes())
 
@@ -48,8 +55,9 @@ def finish_controller(controller, programmers):
         print("No programmer found for controller")
 
 
-def open_controller(ctrl_inport=None, ctrl_outport=None):
+def open_controller(ctrl_inport=None, ctrl_outport=None, backend=None):
     ctrl = {}
+    backend = RtMidiBackend() if backend is None else backend
 
     if ctrl_inport is not None and ctrl_inport.strip() == "":
         ctrl_inport = None
@@ -58,9 +66,10 @@ def open_controller(ctrl_inport=None, ctrl_outport=None):
         ctrl_outport = None
 
     print(f"\nOpening controller input...\n{'=' * 15}")
-    ctrl["input_port"], ctrl["input_name"] = open_midiinput(ctrl_inport)
+    ctrl["input_port"], ctrl["input_name"] = backend.open_input(ctrl_inport)
     print(f"\nOpening controller output...\n{'=' * 15}")
-    ctrl["output_port"], ctrl["output_name"] = open_midioutput(ctrl_outport)
+    ctrl["output_port"], ctrl["output_name"] = \
+        backend.open_output(ctrl_outport)
     return ctrl
 
 
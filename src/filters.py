@@ -7,6 +7,12 @@
 from rtmidi.midiconstants import (CONTROLLER_CHANGE, NOTE_ON, NOTE_OFF)
 
 
+# Compiled data rules: (minimum value of the last data byte, forced value of
+# the last data byte or None to keep it)
+PASS_RULE = (0, None)
+TOGGLE_RULE = (1, 127)
+
+
 class MidiFilter(object):
     """ABC for midi filters."""
 
@@ -29,6 +35,10 @@ class MidiFilter(object):
     def match(self, msg):
         return msg is not None and msg[0] & 0xF0 in self.event_types
 
+    def compile(self, status):
+        """Data rule applied to messages with `status`, None drops them"""
+        return PASS_RULE if status & 0xF0 in self.event_types else None
+
 
 class CutThrough(MidiFilter):
     def _process(self, messages):
@@ -57,6 +67,9 @@ class Toggle(CutThrough):
         if super().match(msg):
             return msg[-1] > 0
 
+    def compile(self, status):
+        return TOGGLE_RULE if super().compile(status) is not None else None
+
     def _process(self, message):
         if self.match(message):
             vel = message[-1]
@@ -95,6 +108,12 @@ class ChannelFilter(CutThrough):
     def match(self, msg):
         return super().match(msg) and msg[0] & 0x0F in self.channels
 
+    def compile(self, status):
+        if status & 0x0F not in self.channels:
+            return None
+
+        return super().compile(status)
+
 
 class Composite(object):
 
@@ -112,3 +131,73 @@ class Composite(object):
             ret = target.process(message)
 
         return ret
+
+    def compile(self, status):
+        # event types of the inner filters do not overlap, first one wins
+        for filt in self.filters:
+            rule = filt.compile(status)
+            if rule is not None:
+                return rule
+
+        return None
+
+
+class CompiledFilter(object):
+    """Filter chain compiled into a lookup table indexed by status byte.
+
+    Each entry holds the data rule every filter in the chain agrees on for
+    that status, or None when some filter drops it. Matching and
+    transforming a message is one table lookup plus the rule on its last
+    data byte.
+    """
+
+    def __init__(self, filters):
+        self.filters = filters
+        self.table = [self._compile(status, filters) for status in range(256)]
+
+    @staticmethod
+    def _compile(status, filters):
+        min_value, forced = PASS_RULE
+        for filt in filters:
+            rule = filt.compile(status)
+            if rule is None:
+                return None
+
+            min_value = max(min_value, rule[0])
+            forced = rule[1] if rule[1] is not None else forced
+
+        return (min_value, forced)
+
+    def match(self, msg):
+        if msg is None:
+            return False
+
+        rule = self.table[msg[0]]
+        return rule is not None and msg[-1] >= rule[0]
+
+    def process(self, msg):
+        """Return the transformed message (in place) or None if dropped"""
+        if msg is None:
+            return None
+
+        rule = self.table[msg[0]]
+        if rule is None or msg[-1] < rule[0]:
+            return None
+
+        if rule[1] is not None:
+            msg[-1] = rule[1]
+
+        return msg
+
+    def process_batch(self, messages):
+        """Filter a list of messages, return the survivors, transformed"""
+        table = self.table
+        batch = []
+        for msg in messages:
+            rule = table[msg[0]]
+            if rule is not None and msg[-1] >= rule[0]:
+                if rule[1] is not None:
+                    msg[-1] = rule[1]
+                batch.append(msg)
+
+        return batch
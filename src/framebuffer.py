@@ -0,0 +1,182 @@
+import threading
+import contextlib
+
+from rtmidi.midiconstants import (
+    NOTE_ON, NOTE_OFF, SYSTEM_EXCLUSIVE, END_OF_EXCLUSIVE
+)
+
+
+class LedSysEx(object):
+    """Bulk LED SysEx format declared in `led_config.led_sysex`.
+
+    `header` holds the hex bytes after which pad specs follow, `pad_spec`
+    the hex bytes of a single pad where `{note}` and `{color}` get replaced
+    and `max_pads` the pads allowed per message (no limit if missing). The
+    Launchpad X "LED lighting" SysEx reads:
+
+        led_sysex:
+          header: F0 00 20 29 02 0C 03
+          pad_spec: 00 {note} {color}
+          max_pads: 81
+    """
+
+    def __init__(self, header, pad_spec="{note} {color}", max_pads=None):
+        self.header = list(bytearray.fromhex(header))
+        if self.header[0] != SYSTEM_EXCLUSIVE:
+            self.header.insert(0, SYSTEM_EXCLUSIVE)
+
+        self.pad_spec = [
+            tok if tok in ("{note}", "{color}") else int(tok, 16)
+            for tok in pad_spec.split()
+        ]
+        self.max_pads = max_pads
+
+    @classmethod
+    def from_config(cls, led_config):
+        sysex = led_config.get("led_sysex", None)
+        if sysex is None:
+            return None
+
+        return cls(**sysex)
+
+    def _pad_bytes(self, note, color):
+        values = {"{note}": note, "{color}": color}
+        return [values.get(tok, tok) for tok in self.pad_spec]
+
+    def pack(self, pads):
+        """Pack `(note, color)` pairs into as few SysEx messages as possible"""
+        pads = list(pads)
+        size = len(pads) if self.max_pads is None else self.max_pads
+        messages = []
+        for start in range(0, len(pads), max(size, 1)):
+            msg = list(self.header)
+            for note, color in pads[start:start + size]:
+                msg.extend(self._pad_bytes(note, color))
+
+            msg.append(END_OF_EXCLUSIVE)
+            messages.append(msg)
+
+        return messages
+
+    def unpack(self, message):
+        """`(note, color)` pairs of a packed message, [] if not ours"""
+        header = len(self.header)
+        if list(message[:header]) != self.header:
+            return []
+
+        size = len(self.pad_spec)
+        note_at = self.pad_spec.index("{note}")
+        color_at = self.pad_spec.index("{color}")
+        body = message[header:-1]
+        return [
+            (body[start + note_at], body[start + color_at])
+            for start in range(0, len(body) - size + 1, size)
+        ]
+
+    def pack_messages(self, messages):
+        """Pack the pad messages in `messages`, others are kept as they are"""
+        pads = []
+        others = []
+        for msg in messages:
+            if len(msg) == 3 and msg[0] & 0xF0 in (NOTE_ON, NOTE_OFF):
+                pads.append((msg[1], LedFrameBuffer._pad_color(msg)))
+            else:
+                others.append(msg)
+
+        return others + self.pack(pads)
+
+
+class LedFrameBuffer(object):
+    """Last color sent to every controller pad.
+
+    Drop-in replacement for the led queue callable: LED writers hand it
+    batches of raw messages and only the pads whose color actually changed
+    are forwarded to `led_queue`. Pads start in an unknown state, so their
+    first write always goes out. With a `LedSysEx` format, changed pads are
+    packed into bulk SysEx messages, and writes made inside `hold` go out
+    as a single frame.
+    """
+
+    def __init__(self, led_queue, sysex=None):
+        self.led_queue = led_queue
+        self.sysex = sysex
+        self._lock = threading.Lock()
+        self._colors = {}
+        self._held = None
+
+    @staticmethod
+    def _pad_key(message):
+        status = message[0]
+        if status & 0xF0 == NOTE_OFF:
+            # note_off and note_on with velocity 0 light the pad off alike
+            status = NOTE_ON | (status & 0x0F)
+
+        return (status, message[1])
+
+    @staticmethod
+    def _pad_color(message):
+        if message[0] & 0xF0 == NOTE_OFF:
+            return 0
+
+        return message[2]
+
+    def _diff(self, messages):
+        changed = []
+        for msg in messages:
+            if len(msg) != 3:
+                # not a pad message (i.e.: sysex), always send
+                changed.append(msg)
+                continue
+
+            key = self._pad_key(msg)
+            color = self._pad_color(msg)
+            if self._colors.get(key, None) != color:
+                self._colors[key] = color
+                changed.append(msg)
+
+        return changed
+
+    def diff(self, messages):
+        """Update the buffer, return the messages that change some pad"""
+        with self._lock:
+            return self._diff(messages)
+
+    def _send(self, messages):
+        if self.sysex is not None:
+            messages = self.sysex.pack_messages(messages)
+
+        if len(messages):
+            self.led_queue(messages)
+
+    def __call__(self, messages):
+        with self._lock:
+            changed = self._diff(messages)
+            if self._held is not None:
+                self._held.extend(changed)
+                return
+
+        if len(changed):
+            self._send(changed)
+
+    @contextlib.contextmanager
+    def hold(self):
+        """Collect every write in the block and send them as one frame"""
+        if self._held is not None:
+            # nested, the outermost block sends
+            yield
+            return
+
+        with self._lock:
+            self._held = []
+        try:
+            yield
+        finally:
+            with self._lock:
+                held, self._held = self._held, None
+            if len(held):
+                self._send(held)
+
+    def invalidate(self):
+        """Forget every pad color, i.e.: after the controller is reset"""
+        with self._lock:
+            self._colors = {}
@@ -0,0 +1,120 @@
+import json
+import time
+import threading
+
+
+class LatencyHistogram(object):
+    """Power of two latency histogram, bucket `i` holds [2^(i-1), 2^i) us"""
+
+    nof_buckets = 24
+
+    def __init__(self):
+        self.buckets = [0] * self.nof_buckets
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, latency_ns):
+        us = max(latency_ns, 0) // 1000
+        self.buckets[min(us.bit_length(), self.nof_buckets - 1)] += 1
+        self.count += 1
+        self.total += latency_ns
+        if latency_ns > self.max:
+            self.max = latency_ns
+
+    def as_dict(self):
+        return dict(
+            count=self.count,
+            mean_us=(self.total / self.count / 1000) if self.count else 0,
+            max_us=self.max / 1000,
+            # upper bound of each bucket in us -> count
+            buckets={
+                str(1 << idx): cnt
+                for idx, cnt in enumerate(self.buckets) if cnt > 0
+            },
+        )
+
+
+class Stamped(object):
+    """Queue item carrying the time its originating event arrived"""
+
+    __slots__ = ("payload", "origin", "source")
+
+    def __init__(self, payload, origin, source="input"):
+        self.payload = payload
+        self.origin = origin
+        self.source = source
+
+
+class LatencyProbe(object):
+    """Per stage latency histograms, measured from the rtmidi callback.
+
+    Disabled by default, every hook is a single attribute test then. The
+    origin of the event being handled is kept per thread, so components
+    downstream of a callback (tracks, led buffers, queues) can stamp what
+    they enqueue without passing it around.
+
+    Stages:
+    * input_filter: controller input leaves the input filters
+    * input_sequencer: controller input reaches `Sequencer.process`
+    * input_led_out: LEDs of a pad press are written to the controller
+    * clock_led_out: LED clock updates are written to the controller
+    * clock_note_out: notes of a clock tick are written to the output port
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.histograms = {}
+        self._local = threading.local()
+
+    @staticmethod
+    def now():
+        return time.monotonic_ns()
+
+    def begin(self, origin, source="input"):
+        self._local.origin = origin
+        self._local.source = source
+
+    def end(self):
+        self._local.origin = None
+
+    @property
+    def origin(self):
+        return getattr(self._local, "origin", None)
+
+    @property
+    def source(self):
+        return getattr(self._local, "source", None)
+
+    def record(self, stage, origin):
+        histogram = self.histograms.get(stage, None)
+        if histogram is None:
+            histogram = self.histograms.setdefault(stage, LatencyHistogram())
+
+        histogram.add(time.monotonic_ns() - origin)
+
+    def stamp(self, payload):
+        """Wrap `payload` with the current origin, if any"""
+        origin = self.origin
+        if origin is None:
+            return payload
+
+        return Stamped(payload, origin, self.source)
+
+    def as_dict(self):
+        return {
+            stage: hist.as_dict()
+            for stage, hist in list(self.histograms.items())
+        }
+
+    def dump(self, path=None):
+        report = json.dumps(self.as_dict(), indent=2)
+        if path is None:
+            print(report)
+        else:
+            with open(path, "w") as fout:
+                fout.write(report)
+
+
+# shared by every component, enabled from main
+probe = LatencyProbe()
@@ -1,14 +1,25 @@
 import yaml
 import time
+import signal
 import argparse
+import numpy as np
 
 from pathlib import Path
-from rtmidi.midiutil import open_midiinput, open_midioutput
 
 from clock import Clock, LedClock
 from wizard import query_yn
 from sequencer import Sequencer
-from midi_queue import InputQueue, OutputQueue
+from pattern_library import PatternLibrary
+from framebuffer import LedFrameBuffer, LedSysEx
+from latency import probe
+from realtime import RealtimeSettings, lock_memory, parse_cpus
+from ports import RtMidiBackend, create_backend
+from midi_queue import (
+    InputQueue,
+    OutputQueue,
+    ScheduledOutputQueue,
+    LedOutputQueue,
+)
 from controller import (
     start_controller,
     finish_controller,
@@ -23,6 +34,8 @@ from modes import (
     LedMode,
     LedColors,
     ClockSource,
+    CatchUpPolicy,
+    QueueBackend,
 )
 
 
@@ -33,15 +46,61 @@ def parse_args():
     parser.add_argument("--ctrl_outport", type=str, default=None)
     parser.add_argument("--output_port", type=str, default=None)
     parser.add_argument("--clock_port", type=str, default=None)
+    parser.add_argument(
+        "--clock_out_ports", type=str, nargs="+", default=None,
+        help="Send MIDI clock (start/stop/continue, song position) to these "
+        "ports, `sequencer` is the sequencer output port"
+    )
+    parser.add_argument(
+        "--latency", action="store_true",
+        help="Collect per stage latency histograms, dumped on SIGUSR1"
+    )
+    parser.add_argument(
+        "--latency_out", type=str, default=None,
+        help="Write latency histograms here at exit (stdout by default)"
+    )
+    parser.add_argument(
+        "--rt_policy", type=str, default=None, choices=["fifo", "rr"],
+        help="Real-time scheduling policy for the clock and output threads"
+    )
+    parser.add_argument(
+        "--rt_priority", type=int, default=50,
+        help="Real-time priority used with --rt_policy (1-99)"
+    )
+    parser.add_argument(
+        "--clock_cpus", type=str, default=None,
+        help="CPUs to pin the clock threads to, i.e.: 2 or 2-3"
+    )
+    parser.add_argument(
+        "--output_cpus", type=str, default=None,
+        help="CPUs to pin the output threads to, i.e.: 1 or 0,1"
+    )
+    parser.add_argument(
+        "--mlock", action="store_true",
+        help="Lock the process memory with mlockall, if allowed"
+    )
+    parser.add_argument(
+        "--port_backend", type=str, default="rtmidi",
+        choices=["rtmidi", "loopback"],
+        help="MIDI ports backend, loopback runs without any MIDI device"
+    )
     return parser.parse_args()
 
 
-def create_clock(config, controller_input, clock_source, clock_port):
+def create_clock(
+    config,
+    controller_input,
+    clock_source,
+    clock_port,
+    realtime=None,
+    backend=None,
+):
+    backend = RtMidiBackend() if backend is None else backend
     port = None
     if clock_source == ClockSource.controller:
         port = controller_input
     elif clock_source == ClockSource.external:
-        port, _ = open_midiinput(clock_port, interactive=True)
+        port, _ = backend.open_input(clock_port, interactive=True)
 
     print(
         f"Using clock source: {clock_source}, "
@@ -51,12 +110,33 @@ def create_clock(config, controller_input, clock_source, clock_port):
         clock_source=clock_source,
         midiin=port,
         bpm=config.get("bpm", 120),
-        signature=config["nof_steps"]
+        signature=config["nof_steps"],
+        spin_us=config.get("clock_spin_us", 1000),
+        catch_up=config.get("clock_catch_up", CatchUpPolicy.burst),
+        dispatch=config.get("clock_dispatch", False),
+        dispatch_priority=config.get("clock_dispatch_nice", None),
+        realtime=realtime,
     )
 
     return clock
 
 
+def open_clock_outputs(clock, clock_out_ports, sequencer_output, backend):
+    """Make the clock master on `clock_out_ports`, return opened ports"""
+    opened = []
+    for port in clock_out_ports or []:
+        if port == "sequencer":
+            midiout = sequencer_output
+        else:
+            midiout, _ = backend.open_output(port, interactive=False)
+            opened.append(midiout)
+
+        print(f"Sending MIDI clock to {port}")
+        clock.add_clock_output(midiout)
+
+    return opened
+
+
 def setup_clock_source(controller_inport, clock_port):
     if controller_inport is not None and controller_inport == clock_port:
         clock_source = ClockSource.controller
@@ -68,28 +148,60 @@ def setup_clock_source(controller_inport, clock_port):
     return clock_source
 
 
-def create_queues(config, controller_output, sequencer_output):
+def create_queues(
+    config, controller_output, sequencer_output, led_sysex=None
+):
+    backend = config.get("queue_backend", QueueBackend.queue)
     input_queue = InputQueue(
         note_mode=config["note_mode"],
         channel=config["input_channel"],
+        backend=backend,
+        batch=config.get("input_batch", False),
     )
     # Probably channel not needed here, messages should already be set
-    output_queue = OutputQueue(
-        midiout=sequencer_output,
-        channel=config["output_channel"]
-    )
-    led_queue = OutputQueue(
-        midiout=controller_output,
-        channel=config["led_config"].get(
-            "led_channel", config["input_channel"]
+    if config.get("lookahead", 0) > 0:
+        output_queue = ScheduledOutputQueue(
+            midiout=sequencer_output,
+            channel=config["output_channel"],
+            spin_us=config.get("clock_spin_us", 1000),
+            backend=backend,
+            latency_stage="note_out",
+        )
+    else:
+        output_queue = OutputQueue(
+            midiout=sequencer_output,
+            channel=config["output_channel"],
+            backend=backend,
+            latency_stage="note_out",
         )
+    led_channel = config["led_config"].get(
+        "led_channel", config["input_channel"]
     )
+    if config["led_config"].get("led_max_fps", None):
+        led_queue = LedOutputQueue(
+            midiout=controller_output,
+            channel=led_channel,
+            max_fps=config["led_config"]["led_max_fps"],
+            sysex=led_sysex,
+            backend=backend,
+            latency_stage="led_out",
+        )
+    else:
+        led_queue = OutputQueue(
+            midiout=controller_output,
+            channel=led_channel,
+            backend=backend,
+            latency_stage="led_out",
+        )
     return (input_queue, output_queue, led_queue)
 
 
 def connect_components(clock, input_queue, controller_input, sequencer):
-    input_queue.add_handler(sequencer.process)
-    clock.add_clock_handler(sequencer)
+    if input_queue.batch:
+        input_queue.add_handler(sequencer.process_batch, batch=True)
+    else:
+        input_queue.add_handler(sequencer.process)
+    clock.add_clock_handler(sequencer, lateness=True)
 
     if clock.clock_source == ClockSource.controller:
         controller_input.set_callback(clock)
@@ -135,36 +247,237 @@ def load_programmers():
     return programmers
 
 
-def main(config, ctrl_inport, ctrl_outport, output_port, clock_port):
-    config = load_config(config)
+def setup_latency(enabled):
+    probe.enabled = enabled
+    if enabled and hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: probe.dump())
+
+
+def setup_realtime(rt_policy, rt_priority, clock_cpus, output_cpus, mlock):
+    if mlock:
+        print(f"Memory locked: {lock_memory()}")
+
+    clock_rt = output_rt = None
+    if rt_policy is not None or clock_cpus is not None:
+        clock_rt = RealtimeSettings(
+            rt_policy, rt_priority, parse_cpus(clock_cpus)
+        )
+
+    if rt_policy is not None or output_cpus is not None:
+        output_rt = RealtimeSettings(
+            rt_policy, rt_priority, parse_cpus(output_cpus)
+        )
+
+    return clock_rt, output_rt
+
+
+def open_pattern_library(config, sequencer):
+    """Open the configured pattern library and load the pattern banks"""
+    path = config.get("pattern_library", None)
+    if path is None:
+        return None
 
+    library = PatternLibrary.open_or_create(
+        path, config["nof_tracks"], config["nof_steps"]
+    )
+    # banks read from consecutive slots, copied only once they play
+    index = config.get("pattern_index", 0)
+    for bank in range(sequencer.nof_banks):
+        if index + bank < len(library):
+            sequencer.attach_bank(
+                bank, library[index + bank], library.locks(index + bank)
+            )
+
+    return library
+
+
+def queue_library_pattern(app, slot, bank=None):
+    """Play library pattern `slot` from the next bar, in `bank` or this one"""
+    library = app["pattern_library"]
+    sequencer = app["sequencer"]
+    if bank is None:
+        bank = sequencer.current_bank
+
+    sequencer.queue_bank(bank, library[slot], library.locks(slot))
+
+
+def save_pattern_library(app):
+    library = app["pattern_library"]
+    if library is None:
+        return
+
+    if not app["config"].get("pattern_library_save", False):
+        library.close()
+        return
+
+    sequencer = app["sequencer"]
+    # banks may read from the slots being overwritten, copy them first
+    banks = [
+        (
+            np.array(sequencer.get_bank(bank)),
+            {
+                name: np.array(values)
+                for name, values in sequencer.get_bank_locks(bank).items()
+            },
+        )
+        for bank in range(sequencer.nof_banks)
+    ]
+    first = min(app["config"].get("pattern_index", 0), len(library))
+    for bank, (data, locks) in enumerate(banks):
+        index = min(first + bank, len(library))
+        library.store(index, data, locks)
+
+    library.close()
+    print(f"Patterns saved to {library.path} [{first}:{index + 1}]")
+
+
+def setup(
+    config,
+    ctrl_inport=None,
+    ctrl_outport=None,
+    output_port=None,
+    clock_port=None,
+    backend=None,
+    clock_rt=None,
+    clock_out_ports=None,
+):
+    """Open ports and build every component, return them in a dict"""
+    backend = RtMidiBackend() if backend is None else backend
     if output_port is not None and output_port.strip() == "":
         output_port = None
 
     clock_source = setup_clock_source(ctrl_inport, clock_port)
-    ctrl = open_controller(ctrl_inport, ctrl_outport)
+    ctrl = open_controller(ctrl_inport, ctrl_outport, backend=backend)
     print(f"\nOpening Sequencer port\n{'=' * 15}")
-    sequencer_output, _ = open_midioutput(output_port)
+    sequencer_output, _ = backend.open_output(output_port)
     start_controller(ctrl, load_programmers())
-    flush_controller(ctrl)
+    led_sysex = LedSysEx.from_config(config["led_config"])
+    # SysEx frames only address the mapped pads, note-offs clear them all
+    pads = None
+    if led_sysex is not None:
+        pads = config["note_input_map"] + (
+            config.get("track_select_map") or []
+        )
+
+    flush_controller(ctrl, led_sysex, notes=pads)
 
-    clock = create_clock(config, ctrl["input_port"], clock_source, clock_port)
+    clock = create_clock(
+        config,
+        ctrl["input_port"],
+        clock_source,
+        clock_port,
+        realtime=clock_rt,
+        backend=backend,
+    )
+    clock_outputs = open_clock_outputs(
+        clock, clock_out_ports, sequencer_output, backend
+    )
     input_queue, output_queue, led_queue = create_queues(
         config=config,
         controller_output=ctrl["output_port"],
         sequencer_output=sequencer_output,
+        led_sysex=led_sysex,
     )
-    sequencer = Sequencer(config, output_queue, led_queue)
+    # every LED writer goes through the framebuffer, only changes get out,
+    # a rate limited led queue packs SysEx frames itself
+    if isinstance(led_queue, LedOutputQueue):
+        led_frame = LedFrameBuffer(led_queue)
+    else:
+        led_frame = LedFrameBuffer(led_queue, sysex=led_sysex)
+    sequencer = Sequencer(config, output_queue, led_frame)
     connect_components(clock, input_queue, ctrl["input_port"], sequencer)
     if config["led_config"]["led_clock"]:
-        clock.add_clock_handler(LedClock(config, sequencer, led_queue))
+        clock.add_clock_handler(LedClock(config, sequencer, led_frame))
+
+    pattern_library = open_pattern_library(config, sequencer)
+    return dict(
+        config=config,
+        ctrl=ctrl,
+        sequencer_output=sequencer_output,
+        clock=clock,
+        input_queue=input_queue,
+        output_queue=output_queue,
+        led_queue=led_queue,
+        sequencer=sequencer,
+        pattern_library=pattern_library,
+        clock_outputs=clock_outputs,
+    )
+
 
+def start(app, output_rt=None):
     # start necessary threads: InputQueue, OutputQueue, clock (if internal)
     print("Starting threads...")
-    input_queue.start()
-    led_queue.start()
-    output_queue.start()
-    clock.start()
+    app["input_queue"].start()
+    app["led_queue"].start()
+    app["output_queue"].start()
+    if output_rt is not None:
+        for name in ["output", "led"]:
+            granted = output_rt.apply(app[f"{name}_queue"], name)
+            print(f"Realtime {name} queue: {granted}")
+
+    app["clock"].start()
+    for name, granted in app["clock"].realtime_granted.items():
+        print(f"Realtime {name}: {granted}")
+
+
+def shutdown(app):
+    print("Stopping threads...")
+    for name in ["input", "output", "led"]:
+        print(f"{name} queue: {app[f'{name}_queue'].metrics()}")
+
+    # clock first, the sequencer flushes its pending note-offs on stop
+    app["clock"].stop()
+    app["clock"].close()
+    jitter = app["clock"].jitter_stats()
+    if jitter is not None:
+        print(f"internal clock jitter: {jitter}")
+
+    app["input_queue"].stop()
+    app["led_queue"].stop()
+    app["output_queue"].stop()
+    save_pattern_library(app)
+
+    finish_controller(app["ctrl"], load_programmers())
+    close_controller(app["ctrl"])
+    app["sequencer_output"].close_port()
+    for midiout in app["clock_outputs"]:
+        midiout.close_port()
+
+
+def main(
+    config,
+    ctrl_inport,
+    ctrl_outport,
+    output_port,
+    clock_port,
+    latency=False,
+    latency_out=None,
+    rt_policy=None,
+    rt_priority=50,
+    clock_cpus=None,
+    output_cpus=None,
+    mlock=False,
+    port_backend="rtmidi",
+    clock_out_ports=None,
+):
+    config = load_config(config)
+    setup_latency(latency)
+    clock_rt, output_rt = setup_realtime(
+        rt_policy, rt_priority, clock_cpus, output_cpus, mlock
+    )
+
+    app = setup(
+        config,
+        ctrl_inport,
+        ctrl_outport,
+        output_port,
+        clock_port,
+        backend=create_backend(port_backend),
+        clock_rt=clock_rt,
+        clock_out_ports=clock_out_ports,
+    )
+    start(app, output_rt)
+    clock = app["clock"]
     print("Ctrl-c to stop the process")
     while True:
         try:
@@ -174,17 +487,11 @@ def main(config, ctrl_inport, ctrl_outport, output_port, clock_port):
             if query_yn("Exit?"):
                 break
             else:
-                clock.start()
+                clock.start(resume=True)
 
-    print("Stopping threads...")
-    input_queue.stop()
-    led_queue.stop()
-    output_queue.stop()
-    clock.stop()
-
-    finish_controller(ctrl, load_programmers())
-    close_controller(ctrl)
-    sequencer_output.close_port()
+    shutdown(app)
+    if latency:
+        probe.dump(latency_out)
 
 
 if __name__ == "__main__":
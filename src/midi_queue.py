@@ -1,10 +1,24 @@
 import mido
+import time
+import heapq
 import queue
 import logging
+import itertools
 import threading
 
-from modes import NoteMode
-from filters import CutThrough, CCToggle, NoteToggle, ChannelFilter, Composite
+from modes import NoteMode, QueueBackend
+from ring_buffer import RingBuffer
+from latency import probe, Stamped
+from realtime import wait_until
+from framebuffer import LedFrameBuffer
+from filters import (
+    CutThrough,
+    CCToggle,
+    NoteToggle,
+    ChannelFilter,
+    Composite,
+    CompiledFilter,
+)
 from rtmidi.midiconstants import (CONTROLLER_CHANGE, NOTE_ON, NOTE_OFF)
 
 
@@ -15,10 +29,18 @@ class MidiQueue(threading.Thread):
     """
         ABC for Midi Queues
     """
-    def __init__(self, *args, **kwargs):
+    # with the ring backend, producers wait for room rather than dropping
+    # the oldest message when the queue is full
+    ring_block = False
+
+    def __init__(self, *args, backend=QueueBackend.queue, **kwargs):
         super(MidiQueue, self).__init__()
         # self._wallclock = time.time()
-        self.queue = queue.Queue()
+        self.backend = QueueBackend(backend)
+        if self.backend == QueueBackend.ring:
+            self.queue = RingBuffer(block=self.ring_block)
+        else:
+            self.queue = queue.Queue()
         self.args = args
         self.__dict__.update(kwargs)
 
@@ -29,28 +51,51 @@ class MidiQueue(threading.Thread):
         """
         # self._wallclock += deltatime
         # log.debug("IN: @%0.6f %r", self._wallclock, message)
+        arrival = probe.now() if probe.enabled else None
         if isinstance(message, (tuple, list)) and len(message) == 2:
             # skip the timestamp
             message, _ = message
 
-        if self.filter(message):
+        if self.filter(message, arrival):
+            if arrival is not None:
+                message = Stamped(message, arrival)
             self.queue.put(message)
 
-    def filter(self, message):
+    def filter(self, message, arrival=None):
         """
             Override this method to filter messages out.
-            Let anything through by default
+            Let anything through by default, `arrival` is the probe time
+            of the message, None when the probe is off
         """
         return True
 
+    def get_batch(self, timeout=None):
+        """Block until messages are pending, return all of them in a list"""
+        if self.backend == QueueBackend.ring:
+            return self.queue.drain(timeout)
+
+        batch = [self.queue.get(timeout=timeout)]
+        try:
+            while True:
+                batch.append(self.queue.get_nowait())
+        except queue.Empty:
+            pass
+
+        return batch
+
+    def metrics(self):
+        if self.backend == QueueBackend.ring:
+            return self.queue.metrics()
+
+        return dict(depth=self.queue.qsize())
+
     def run(self):
         while True:
-            message = self.queue.get()
-
-            if message is None:
-                break
+            for message in self.get_batch():
+                if message is None:
+                    return
 
-            self.process(message)
+                self.process(message)
 
     def process(self, message):
         raise ValueError(
@@ -69,11 +114,28 @@ class MidiQueue(threading.Thread):
 # - Specific filter for the basics?
 # - Allow CC toggle (i.e.: for track selection with arrows?)
 class InputQueue(MidiQueue):
-    def __init__(self, note_mode=None, channel=0):
+    """
+        Filters controller input and hands it to the handlers as mido
+        messages.
+
+        In batch mode, messages are filtered on the queue thread: every
+        pending message is drained at once, the whole batch goes through the
+        filter chain in one call, and batch handlers get the survivors as a
+        list (other handlers still get them one by one).
+    """
+    def __init__(
+        self,
+        note_mode=None,
+        channel=0,
+        backend=QueueBackend.queue,
+        batch=False,
+    ):
         note_mode = NoteMode(
             NoteMode.default if note_mode is None else note_mode
         )
-        super(InputQueue, self).__init__(note_mode=note_mode, channel=channel)
+        super(InputQueue, self).__init__(
+            note_mode=note_mode, channel=channel, backend=backend, batch=batch
+        )
         self._handlers = []
         # filter pipeline:
         # - channel filter - note filter if note event, cc filter if cc event
@@ -91,34 +153,121 @@ class InputQueue(MidiQueue):
             # veolicty == 0 when released, avoid duplication
             self.filters.append(Composite(CCToggle(), NoteToggle()))
 
-    def filter(self, message):
-        return any([filt.match(message) for filt in self.filters])
+        self.compiled_filter = CompiledFilter(self.filters)
+
+    def filter(self, message, arrival=None):
+        if self.batch:
+            # filtered by batches in `run`
+            return True
+
+        # match and transform in one lookup, only messages that survive the
+        # whole chain get enqueued, already transformed
+        passed = self.compiled_filter.process(message) is not None
+        if passed and arrival is not None:
+            probe.record("input_filter", arrival)
 
-    def add_handler(self, fn):
+        return passed
+
+    def add_handler(self, fn, batch=False):
         log.debug(f"Added handler: {fn}")
-        self._handlers.append(fn)
+        self._handlers.append((fn, batch))
+
+    def _dispatch(self, midomsgs, origin=None):
+        if origin is not None:
+            # downstream writes get stamped with our origin
+            probe.begin(origin, "input")
+
+        for hand, batch in self._handlers:
+            if batch:
+                hand(midomsgs)
+            else:
+                for midomsg in midomsgs:
+                    hand(midomsg)
+
+        if origin is not None:
+            probe.end()
 
     def process(self, message):
+        origin = None
+        if isinstance(message, Stamped):
+            origin, message = message.origin, message.payload
+
         if message is not None:
-            midomsg = None
-            for filt in self.filters:
-                message = filt.process(message)
-                if message is None:
-                    break
+            # already filtered on arrival, see `filter`
+            self._dispatch([mido.parse(message)], origin)
 
-            if message is not None:
-                midomsg = mido.parse(message)
+    def process_batch(self, messages):
+        origin = None
+        raw = []
+        for message in messages:
+            if isinstance(message, Stamped):
+                # latency of a batch is the one of its oldest message
+                if origin is None:
+                    origin = message.origin
+                message = message.payload
+            raw.append(message)
 
-            if midomsg is not None:
-                for hand in self._handlers:
-                    hand(midomsg)
+        raw = self.compiled_filter.process_batch(raw)
+        if len(raw):
+            if origin is not None:
+                probe.record("input_filter", origin)
+
+            self._dispatch([mido.parse(msg) for msg in raw], origin)
+
+    def run(self):
+        if not self.batch:
+            return super(InputQueue, self).run()
+
+        running = True
+        while running:
+            batch = self.get_batch()
+            if None in batch:
+                batch = batch[:batch.index(None)]
+                running = False
+
+            self.process_batch(batch)
 
 
 class OutputQueue(MidiQueue):
-    def __init__(self, midiout, channel):
-        super(OutputQueue, self).__init__(midiout=midiout, channel=channel)
+    # dropping would lose note offs
+    ring_block = True
+
+    def __init__(
+        self,
+        midiout,
+        channel,
+        backend=QueueBackend.queue,
+        latency_stage=None,
+    ):
+        super(OutputQueue, self).__init__(
+            midiout=midiout,
+            channel=channel,
+            backend=backend,
+            latency_stage=latency_stage,
+        )
+
+    def __call__(self, message, data=None):
+        # batches come from our own components, never with a timestamp, a
+        # batch of two messages must not be taken for (message, deltatime)
+        self.put(message)
+
+    def put(self, data):
+        if probe.enabled:
+            data = probe.stamp(data)
+        self.queue.put(data)
+
+    def _record_latency(self, source, origin):
+        if self.latency_stage is not None:
+            probe.record(f"{source}_{self.latency_stage}", origin)
 
     def process(self, message):
+        if isinstance(message, Stamped):
+            self._send(message.payload)
+            self._record_latency(message.source, message.origin)
+        else:
+            self._send(message)
+
+    def _send(self, message):
         if len(message):
             # ToDo := Maybe add channel changer
             if isinstance(message, list) and isinstance(message[0], list):
@@ -127,3 +276,239 @@ class OutputQueue(MidiQueue):
                     self.midiout.send_message(msg)
             else:
                 self.midiout.send_message(message)
+
+
+class ScheduledOutputQueue(OutputQueue):
+    """
+        Output queue that releases timestamped batches on time.
+
+        Batches handed through `schedule` carry a `time.monotonic_ns()`
+        deadline, they are kept in a heap and sent when due, sleeping until
+        `spin_us` before the deadline and busy-waiting the rest. Batches
+        handed through `put`/`__call__` are sent right away.
+    """
+    # `cancel_pending` marker, handled on the queue thread
+    _CANCEL = object()
+
+    def __init__(
+        self,
+        midiout,
+        channel,
+        spin_us=1000,
+        backend=QueueBackend.queue,
+        latency_stage=None,
+    ):
+        super(ScheduledOutputQueue, self).__init__(
+            midiout=midiout,
+            channel=channel,
+            backend=backend,
+            latency_stage=latency_stage,
+        )
+        self.spin_ns = int(spin_us * 1000)
+        self._pending = []
+        self._order = itertools.count()
+        # (channel, note) -> (deadline, order, message) of its note-off
+        self._note_offs = {}
+        # (order, (channel, note)) of note-offs no longer due with their batch
+        self._cancelled = set()
+        # (channel, note) of the notes sent and not ended yet
+        self._sounding = set()
+
+    def schedule(self, timestamp, message):
+        self.queue.put((timestamp, message))
+
+    def cancel_pending(self):
+        """Drop the scheduled batches, their note-offs are sent right away"""
+        self.queue.put(self._CANCEL)
+
+    def _push(self, timestamp, message):
+        """Queue a scheduled batch, ending retriggered notes first.
+
+        A note played again before its pending note-off is due gets the
+        note-off moved right before it, so it does not cut the new note.
+        """
+        if len(message) and not isinstance(message[0], list):
+            message = [message]
+
+        order = next(self._order)
+        batch = []
+        for msg in message:
+            status = msg[0] & 0xF0
+            if status == NOTE_ON and msg[2] > 0:
+                key = (msg[0] & 0x0F, msg[1])
+                pending = self._note_offs.get(key, None)
+                if pending is not None and pending[0] > timestamp:
+                    del self._note_offs[key]
+                    self._cancelled.add((pending[1], key))
+                    batch.append(pending[2])
+            elif status in (NOTE_ON, NOTE_OFF):
+                key = (msg[0] & 0x0F, msg[1])
+                self._note_offs[key] = (timestamp, order, msg)
+
+            batch.append(msg)
+
+        heapq.heappush(self._pending, (timestamp, order, batch))
+
+    def _due(self, order, batch):
+        """`batch` without the note-offs already sent or moved"""
+        due = []
+        for msg in batch:
+            status = msg[0] & 0xF0
+            if status == NOTE_OFF or (status == NOTE_ON and msg[2] == 0):
+                key = (msg[0] & 0x0F, msg[1])
+                if (order, key) in self._cancelled:
+                    self._cancelled.remove((order, key))
+                    continue
+
+                if self._note_offs.get(key, (None, None))[1] == order:
+                    del self._note_offs[key]
+
+                self._sounding.discard(key)
+            elif status == NOTE_ON:
+                self._sounding.add((msg[0] & 0x0F, msg[1]))
+
+            due.append(msg)
+
+        return due
+
+    def _cancel(self):
+        # notes not played yet never sound, the others are ended now
+        msgs = [
+            msg for key, (_, _, msg) in self._note_offs.items()
+            if key in self._sounding
+        ]
+        self._pending = []
+        self._note_offs = {}
+        self._cancelled = set()
+        self._sounding = set()
+        self.process(msgs)
+
+    def _release_due(self):
+        """Send every due batch, return ns until the next one (or None)"""
+        while len(self._pending):
+            deadline = self._pending[0][0]
+            remaining = deadline - time.monotonic_ns()
+            if remaining > self.spin_ns:
+                return remaining - self.spin_ns
+
+            wait_until(deadline)
+            _, order, batch = heapq.heappop(self._pending)
+            self.process(self._due(order, batch))
+
+        return None
+
+    def run(self):
+        running = True
+        while running:
+            wait = self._release_due()
+            try:
+                batch = self.get_batch(
+                    timeout=None if wait is None else wait / 1e9
+                )
+            except queue.Empty:
+                continue
+
+            for item in batch:
+                if item is None:
+                    running = False
+                    break
+
+                if item is self._CANCEL:
+                    self._cancel()
+                elif isinstance(item, tuple):
+                    self._push(*item)
+                else:
+                    self.process(item)
+
+        # pending batches are dropped on stop
+        self._pending = []
+        self._note_offs = {}
+        self._cancelled = set()
+        self._sounding = set()
+
+
+class LedOutputQueue(OutputQueue):
+    """
+        LED queue sending coalesced frames at most `max_fps` times a second.
+
+        Pending messages to the same pad are merged, only the last one is
+        sent, so a burst of pad edits costs at most one frame and never
+        delays the next playhead update. With a `LedSysEx` format, each frame
+        is packed into bulk SysEx messages.
+    """
+    def __init__(
+        self,
+        midiout,
+        channel,
+        max_fps=60,
+        sysex=None,
+        backend=QueueBackend.queue,
+        latency_stage=None,
+    ):
+        super(LedOutputQueue, self).__init__(
+            midiout=midiout,
+            channel=channel,
+            backend=backend,
+            latency_stage=latency_stage,
+        )
+        self.period = 1. / max_fps
+        self.sysex = sysex
+        self._pending = {}
+        self._order = itertools.count()
+        # oldest origin per source merged into the pending frame
+        self._origins = {}
+
+    def _merge(self, message):
+        if isinstance(message, Stamped):
+            prev = self._origins.get(message.source, message.origin)
+            self._origins[message.source] = min(prev, message.origin)
+            message = message.payload
+
+        if len(message) and not isinstance(message[0], list):
+            message = [message]
+
+        for msg in message:
+            if len(msg) == 3:
+                key = LedFrameBuffer._pad_key(msg)
+                # keep the pad where it was first queued, last value wins
+                self._pending[key] = msg
+            else:
+                self._pending[next(self._order)] = msg
+
+    def _flush(self):
+        frame = list(self._pending.values())
+        self._pending = {}
+        if self.sysex is not None:
+            frame = self.sysex.pack_messages(frame)
+
+        if len(frame):
+            self._send(frame)
+
+        for source, origin in self._origins.items():
+            self._record_latency(source, origin)
+        self._origins = {}
+
+    def run(self):
+        next_frame = time.monotonic()
+        running = True
+        while running:
+            timeout = None
+            if len(self._pending):
+                timeout = max(next_frame - time.monotonic(), 0)
+
+            try:
+                batch = self.get_batch(timeout=timeout)
+            except queue.Empty:
+                batch = []
+
+            for item in batch:
+                if item is None:
+                    running = False
+                    break
+
+                self._merge(item)
+
+            now = time.monotonic()
+            if len(self._pending) and (now >= next_frame or not running):
+                self._flush()
+                next_frame = now + self.period
@@ -52,3 +52,32 @@ class ClockSource(Enum):
     controller = "controller"
     external = "external"
     internal = "internal"
+
+
+class CatchUpPolicy(Enum):
+    """Catch-up policies for late internal clock ticks
+    * burst: every missed tick is sent as soon as possible, keeps tick count
+    * skip: missed ticks are dropped, the schedule realigns to the tick grid
+    """
+    burst = "burst"
+    skip = "skip"
+
+
+class QueueBackend(Enum):
+    """Midi queue backends
+    * queue: `queue.Queue`, one wake-up per message
+    * ring: bounded ring buffer, drained in batches with depth metrics
+    """
+    queue = "queue"
+    ring = "ring"
+
+
+class CommitMode(Enum):
+    """Pattern edit commit modes
+    * immediate: edits sound as soon as they are made
+    * step: edits are committed on the next step boundary
+    * bar: edits are committed when the pattern wraps around to its first step
+    """
+    immediate = "immediate"
+    step = "step"
+    bar = "bar"
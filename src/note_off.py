@@ -0,0 +1,72 @@
+from rtmidi.midiconstants import NOTE_OFF
+
+
+def note_off(message):
+    """Note-off matching a note-on message"""
+    return [NOTE_OFF | (message[0] & 0x0F), message[1], 0]
+
+
+class NoteOffWheel(object):
+    """Timing wheel of pending note-offs, one slot per clock pulse.
+
+    Scheduling and popping the note-offs due on a pulse are O(1). Slots are
+    keyed by `(channel, note)`, a note retriggered before its note-off is
+    due takes the pending note-off out so it does not cut the new note.
+    """
+
+    def __init__(self, size=256):
+        self.size = size
+        self._slots = [{} for _ in range(size)]
+        # (channel, note) -> slot of its pending note-off
+        self._pending = {}
+        self._cursor = 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    def schedule(self, pulses, message):
+        """Send `message` (a note-off) `pulses` pulses from now"""
+        if pulses >= self.size:
+            raise ValueError(
+                f"Note-off {pulses} pulses ahead, the wheel holds {self.size}"
+            )
+
+        key = (message[0] & 0x0F, message[1])
+        self.cancel(key)
+        slot = (self._cursor + max(pulses, 1)) % self.size
+        self._slots[slot][key] = message
+        self._pending[key] = slot
+
+    def cancel(self, key):
+        """Drop the pending note-off of `(channel, note)`, return it"""
+        slot = self._pending.pop(key, None)
+        if slot is None:
+            return None
+
+        return self._slots[slot].pop(key, None)
+
+    def pop(self):
+        """Pop the note-offs due on the current pulse"""
+        due = self._slots[self._cursor]
+        if not len(due):
+            return []
+
+        self._slots[self._cursor] = {}
+        for key in due:
+            del self._pending[key]
+
+        return list(due.values())
+
+    def advance(self):
+        """Move on to the next pulse"""
+        self._cursor = (self._cursor + 1) % self.size
+
+    def flush(self):
+        """Pop every pending note-off"""
+        messages = []
+        for slot in set(self._pending.values()):
+            messages.extend(self._slots[slot].values())
+            self._slots[slot] = {}
+
+        self._pending = {}
+        return messages
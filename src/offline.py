@@ -0,0 +1,302 @@
+"""Headless render of the sequencer, faster than real time.
+
+A virtual clock feeds 24 PPQN pulses into `Clock`, which drives the
+`Sequencer` and `LedClock` exactly as a live clock would. Every message
+they emit is stamped with the virtual time and collected in memory or
+streamed to a file, one line per event:
+
+    <time in ms> <notes|leds> <hex bytes>
+
+or, for `.mid` outputs, to a Standard MIDI File with the note events. A
+chain of patterns (`.npy` tracks x steps arrays or pattern library slots,
+each with a repeat count) is played back to back, switching on bar
+boundaries.
+"""
+
+import argparse
+import numpy as np
+
+from rtmidi.midiconstants import (
+    TIMING_CLOCK,
+    SONG_START,
+    SONG_STOP,
+    NOTE_ON,
+    NOTE_OFF,
+)
+
+from clock import Clock, LedClock
+from main import load_config
+from modes import ClockSource
+from pattern import LOCKS
+from pattern_library import PatternLibrary
+from sequencer import Sequencer
+from smf import SmfWriter
+
+
+class CaptureQueue(object):
+    """Output/led queue stand-in recording messages at the virtual time"""
+
+    def __init__(self, engine, port):
+        self.engine = engine
+        self.port = port
+
+    def put(self, messages):
+        self.engine.emit(self.engine.now_ns, self.port, messages)
+
+    def __call__(self, messages):
+        self.put(messages)
+
+    def schedule(self, timestamp, messages):
+        self.engine.emit(timestamp, self.port, messages)
+
+
+class OfflineEngine(object):
+    """Sequencer and LED clock on a virtual clock.
+
+    `gate_pulses` is given to the tracks configured without a gate, so
+    every note gets its note-off, i.e.: for Standard MIDI File exports.
+    """
+
+    def __init__(self, config, bpm=None, ppqn=24, gate_pulses=None):
+        config = dict(config)
+        # steps go out when ticked, virtual time has no use for lookahead
+        config["lookahead"] = 0
+        # renders of the same pattern play the same probability dice
+        config.setdefault("seed", 0)
+        if gate_pulses is not None:
+            gates = config.get("track_gates", None) or (
+                [config.get("gate_pulses", 0)] * config["nof_tracks"]
+            )
+            config["track_gates"] = [gate or gate_pulses for gate in gates]
+
+        self.config = config
+        self.bpm = bpm if bpm is not None else config.get("bpm", 120)
+        self.ppqn = ppqn
+        self.pulse_ns = int(60e9 / (self.bpm * ppqn))
+        self.now_ns = 0
+        self._sink = None
+
+        self.note_queue = CaptureQueue(self, "notes")
+        self.led_queue = CaptureQueue(self, "leds")
+        self.clock = Clock(
+            clock_source=ClockSource.internal,
+            midiin=None,
+            bpm=self.bpm,
+            signature=config["nof_steps"],
+        )
+        self.sequencer = Sequencer(config, self.note_queue, self.led_queue)
+        # virtual time does not wait for a worker thread
+        self.sequencer.banks.prepare_async = False
+        self.clock.add_clock_handler(self.sequencer)
+        if config["led_config"].get("led_clock", False):
+            self.clock.add_clock_handler(
+                LedClock(config, self.sequencer, self.led_queue)
+            )
+
+    def emit(self, time_ns, port, messages):
+        if self._sink is None or not len(messages):
+            return
+
+        if not isinstance(messages[0], (list, tuple, bytes, bytearray)):
+            messages = [messages]
+
+        for msg in messages:
+            self._sink(time_ns, port, msg)
+
+    def pulses_per_bar(self):
+        # the sequencer wraps after all of its steps
+        return self.sequencer.step_pulses * self.sequencer.nof_steps
+
+    def chain_bars(self, chain):
+        return sum(entry[1] for entry in chain)
+
+    def _chain_patterns(self, chain):
+        """`(pattern, locks)` to load on every bar, None to keep going"""
+        for data, repeats, *locks in chain:
+            yield data, locks[0] if len(locks) else None
+            for _ in range(repeats - 1):
+                yield None
+
+    def run(self, bars, sink, chain=None):
+        """Feed `bars` worth of clock pulses, `sink(time_ns, port, msg)`.
+
+        With a `chain` of `(pattern, repeats)` or `(pattern, repeats,
+        locks)` entries, `bars` defaults to the length of the chain and
+        patterns are loaded on bar boundaries.
+        """
+        if chain is not None and bars is None:
+            bars = self.chain_bars(chain)
+
+        patterns = iter(self._chain_patterns(chain or []))
+        pulses_per_bar = self.pulses_per_bar()
+        self._sink = sink
+        try:
+            self.clock([SONG_START])
+            for pulse in range(bars * pulses_per_bar):
+                self.now_ns = pulse * self.pulse_ns
+                if pulse % pulses_per_bar == 0:
+                    entry = next(patterns, None)
+                    if entry is not None:
+                        self.sequencer.load_pattern(*entry)
+
+                self.clock([TIMING_CLOCK])
+
+            self.now_ns = bars * self.pulses_per_bar() * self.pulse_ns
+            self.clock([SONG_STOP])
+        finally:
+            self._sink = None
+
+    def render(self, bars, chain=None):
+        """Render to a list of `(time_ns, port, message)` events"""
+        events = []
+        self.run(
+            bars, lambda time_ns, port, msg: events.append(
+                (time_ns, port, list(msg))
+            ), chain
+        )
+        return events
+
+    def render_to_file(self, bars, path, ports=("notes", "leds"), chain=None):
+        """Stream the events of `ports` to a text file"""
+        with open(path, "w") as fout:
+            def write(time_ns, port, msg):
+                if port in ports:
+                    fout.write(
+                        f"{time_ns / 1e6:.3f} {port} {bytes(msg).hex(' ')}\n"
+                    )
+
+            self.run(bars, write, chain)
+
+    def time_signature(self):
+        """Bar length as `(numerator, denominator)`, 4/4 if it has none"""
+        pulses = self.pulses_per_bar()
+        for denominator in (4, 8, 16, 32):
+            # a whole note is 4 * ppqn pulses
+            numerator, rest = divmod(pulses * denominator, 4 * self.ppqn)
+            if rest == 0 and 0 < numerator < 256:
+                return numerator, denominator
+
+        return 4, 4
+
+    def render_to_smf(self, bars, path, chain=None, division=480):
+        """Stream the note events to a Standard MIDI File.
+
+        Notes left without a note-off (tracks with no gate) are ended when
+        played again or at the end of the track, see `gate_pulses`.
+        """
+        if chain is not None and bars is None:
+            bars = self.chain_bars(chain)
+
+        end_ns = bars * self.pulses_per_bar() * self.pulse_ns
+        # (status, note) of the notes sounding
+        sounding = set()
+        with SmfWriter(
+            path,
+            bpm=self.bpm,
+            division=division,
+            time_signature=self.time_signature(),
+        ) as smf:
+            def write(time_ns, port, msg):
+                if port != "notes":
+                    return
+
+                status = msg[0] & 0xF0
+                key = (msg[0] & 0x0F, msg[1])
+                if status == NOTE_ON and msg[2] > 0:
+                    if key in sounding:
+                        smf.write(time_ns, [NOTE_OFF | key[0], key[1], 0])
+
+                    sounding.add(key)
+                elif status in (NOTE_ON, NOTE_OFF):
+                    sounding.discard(key)
+
+                smf.write(time_ns, msg)
+
+            self.run(bars, write, chain)
+            for channel, note in sorted(sounding):
+                smf.write(end_ns, [NOTE_OFF | channel, note, 0])
+
+            smf.close(end_ns)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", type=str, required=True)
+    parser.add_argument(
+        "--bars", type=int, default=None,
+        help="Bars to render, defaults to 1 or the length of the chain"
+    )
+    parser.add_argument("--bpm", type=float, default=None)
+    parser.add_argument(
+        "--out", type=str, required=True,
+        help="Event text file, or Standard MIDI File when ending in .mid"
+    )
+    parser.add_argument(
+        "--chain", type=str, nargs="+", default=None,
+        help="Patterns to play in order, as pattern.npy[:repeats] or "
+        "library[@index][:repeats]"
+    )
+    parser.add_argument(
+        "--no_leds", action="store_true", help="Only write note events"
+    )
+    parser.add_argument(
+        "--randomize", type=float, default=None,
+        help="Fill the pattern with this density of random steps"
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0,
+        help="Seeds --randomize and the step probabilities"
+    )
+    return parser.parse_args()
+
+
+def parse_chain(specs):
+    """`pattern.npy[:repeats]` or `library[@index][:repeats]` specs"""
+    chain = []
+    for spec in specs:
+        path, _, repeats = spec.partition(":")
+        if path.endswith(".npy"):
+            data, locks = np.load(path), None
+        else:
+            path, _, index = path.partition("@")
+            library = PatternLibrary(path, readonly=True)
+            # step locks play along, as on the device
+            data = library[int(index or 0)]
+            locks = library.locks(int(index or 0))
+
+        if locks is None:
+            # no locks stored, none left over from the previous pattern
+            locks = {name: default for name, (_, default) in LOCKS.items()}
+
+        chain.append((data, int(repeats or 1), locks))
+
+    return chain
+
+
+def main(config, bars, bpm, out, chain, no_leds, randomize, seed):
+    config = load_config(config)
+    gate_pulses = None
+    if out.endswith(".mid"):
+        # DAWs need note-offs, tracks without a gate play one step long
+        gate_pulses = int((4 / config["nof_steps"]) * 24)
+
+    config["seed"] = seed
+    engine = OfflineEngine(config, bpm=bpm, gate_pulses=gate_pulses)
+    if randomize is not None:
+        engine.sequencer.randomize_pattern(
+            randomize, rng=np.random.default_rng(seed)
+        )
+
+    chain = parse_chain(chain) if chain is not None else None
+    if bars is None and chain is None:
+        bars = 1
+
+    if out.endswith(".mid"):
+        engine.render_to_smf(bars, out, chain=chain)
+    else:
+        ports = ("notes",) if no_leds else ("notes", "leds")
+        engine.render_to_file(bars, out, ports=ports, chain=chain)
+
+
+if __name__ == "__main__":
+    main(**vars(parse_args()))
@@ -0,0 +1,84 @@
+import numpy as np
+
+# per step parameters, name: (dtype, default)
+# - probability: chance of the step to play, in %
+# - ratchets: times the step repeats within its length
+# - micro: timing offset in clock pulses, negative plays early
+# - gate: note length in clock pulses, 0 for the track default
+LOCKS = {
+    "probability": (np.uint8, 100),
+    "ratchets": (np.uint8, 1),
+    "micro": (np.int8, 0),
+    "gate": (np.uint8, 0),
+}
+# accepted values, name: (min, max)
+LOCK_RANGES = {
+    "probability": (0, 100),
+    "ratchets": (1, 255),
+    "micro": (-128, 127),
+    "gate": (0, 255),
+}
+
+
+class Pattern(object):
+    """Step velocities of every track in one contiguous tracks x steps array.
+
+    Each `Track` works on a row view of the same array, so edits made through
+    a track are seen by the sequencer without copies. Ticks read one column,
+    bulk operations work on the whole matrix (or a subset of rows) at once.
+    Per step parameter locks are kept the same way, one tracks x steps array
+    per parameter in `locks`.
+    """
+
+    def __init__(self, nof_tracks, nof_steps):
+        self.nof_tracks = nof_tracks
+        self.nof_steps = nof_steps
+        self.data = np.zeros((nof_tracks, nof_steps), dtype=np.uint8)
+        self.locks = {
+            name: np.full((nof_tracks, nof_steps), default, dtype=dtype)
+            for name, (dtype, default) in LOCKS.items()
+        }
+
+    def row(self, track_id):
+        return self.data[track_id]
+
+    def column(self, step):
+        return self.data[:, step]
+
+    def lock_column(self, step):
+        return {name: lock[:, step] for name, lock in self.locks.items()}
+
+    def _rows(self, track_ids):
+        return slice(None) if track_ids is None else list(track_ids)
+
+    def clear(self, track_ids=None):
+        rows = self._rows(track_ids)
+        self.data[rows] = 0
+        for name, lock in self.locks.items():
+            lock[rows] = LOCKS[name][1]
+
+    def shift(self, amount, track_ids=None):
+        """Rotate steps `amount` positions to the right (left if negative)"""
+        rows = self._rows(track_ids)
+        self.data[rows] = np.roll(self.data[rows], amount, axis=1)
+        for lock in self.locks.values():
+            lock[rows] = np.roll(lock[rows], amount, axis=1)
+
+    def randomize(self, density=0.25, velocity=127, track_ids=None, rng=None):
+        rng = np.random.default_rng() if rng is None else rng
+        rows = self._rows(track_ids)
+        shape = self.data[rows].shape
+        self.data[rows] = np.where(
+            rng.random(shape) < density, velocity, 0
+        ).astype(np.uint8)
+
+    def copy_track(self, src_track_id, dst_track_id):
+        self.data[dst_track_id] = self.data[src_track_id]
+        for lock in self.locks.values():
+            lock[dst_track_id] = lock[src_track_id]
+
+    def load(self, data, locks=None):
+        """Copy `data` and `locks` in place, keeping row views valid"""
+        self.data[...] = data
+        for name, values in (locks or {}).items():
+            self.locks[name][...] = values
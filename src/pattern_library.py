@@ -0,0 +1,213 @@
+import os
+import struct
+import numpy as np
+
+from pattern import LOCKS
+
+
+MAGIC = b"DSPL"
+# 1: velocities only, 2: velocities and step locks
+VERSION = 2
+# magic, version, nof_tracks, nof_steps, nof_patterns, padded to 16 bytes
+HEADER = struct.Struct("<4sHHHI2x")
+# tracks x steps blocks of a pattern, after the velocities
+LOCK_BLOCKS = list(LOCKS)
+
+
+class PatternLibrary(object):
+    """Patterns stored back to back in a memory-mapped file.
+
+    The file is a 16 bytes header followed by one tracks x steps block of
+    uint8 velocities per pattern, then one block per step lock (see
+    `pattern.LOCKS`). Patterns are served as views on the mapping:
+    switching patterns costs no parsing nor allocation, only the copy done
+    by `Sequencer.load_pattern`. Version 1 files, velocities only, are
+    upgraded when opened for writing.
+
+        library = PatternLibrary.create("set.dspl", 8, 16)
+        library.append(sequencer.get_all_track_states(), locks)
+        sequencer.load_pattern(library[3], library.locks(3))
+    """
+
+    def __init__(self, path, nof_tracks=None, nof_steps=None, readonly=False):
+        self.path = path
+        self.readonly = readonly
+        self._map(readonly)
+        if self.version < VERSION and not readonly:
+            self._upgrade()
+
+        if (
+            (nof_tracks is not None and nof_tracks != self.nof_tracks) or
+            (nof_steps is not None and nof_steps != self.nof_steps)
+        ):
+            raise ValueError(
+                f"Pattern library {path} holds {self.nof_tracks} tracks x "
+                f"{self.nof_steps} steps patterns, config has {nof_tracks} x "
+                f"{nof_steps}"
+            )
+
+    @classmethod
+    def create(cls, path, nof_tracks, nof_steps, capacity=16):
+        cls._write_empty(path, nof_tracks, nof_steps, capacity)
+        return cls(path, nof_tracks, nof_steps)
+
+    @classmethod
+    def _write_empty(cls, path, nof_tracks, nof_steps, capacity):
+        with open(path, "wb") as fout:
+            fout.write(HEADER.pack(MAGIC, VERSION, nof_tracks, nof_steps, 0))
+            fout.truncate(HEADER.size + capacity * cls._pattern_size(
+                nof_tracks, nof_steps, VERSION
+            ))
+
+    @staticmethod
+    def _pattern_size(nof_tracks, nof_steps, version):
+        blocks = 1 if version == 1 else 1 + len(LOCK_BLOCKS)
+        return blocks * nof_tracks * nof_steps
+
+    @classmethod
+    def open_or_create(cls, path, nof_tracks, nof_steps):
+        if os.path.exists(path):
+            return cls(path, nof_tracks, nof_steps)
+
+        return cls.create(path, nof_tracks, nof_steps)
+
+    def _map(self, readonly):
+        self._mm = np.memmap(
+            self.path, dtype=np.uint8, mode="r" if readonly else "r+"
+        )
+        if self._mm.size < HEADER.size:
+            raise ValueError(f"{self.path} is not a pattern library")
+
+        magic, version, nof_tracks, nof_steps, count = HEADER.unpack(
+            self._mm[:HEADER.size].tobytes()
+        )
+        if magic != MAGIC or not 1 <= version <= VERSION:
+            raise ValueError(f"{self.path} is not a pattern library")
+
+        self.version = version
+        self.nof_tracks = nof_tracks
+        self.nof_steps = nof_steps
+        self._count = count
+        pattern_size = self._pattern_size(nof_tracks, nof_steps, version)
+        capacity = (self._mm.size - HEADER.size) // pattern_size
+        # capacity x blocks x tracks x steps, velocities in block 0
+        self._slots = self._mm[
+            HEADER.size:HEADER.size + capacity * pattern_size
+        ].reshape(capacity, -1, nof_tracks, nof_steps)
+        self._patterns = self._slots[:, 0]
+
+    def _write_count(self):
+        self._mm[:HEADER.size] = np.frombuffer(HEADER.pack(
+            MAGIC, self.version, self.nof_tracks, self.nof_steps, self._count
+        ), dtype=np.uint8)
+
+    def _grow(self, capacity):
+        self._mm.flush()
+        del self._slots, self._patterns, self._mm
+        pattern_size = self._pattern_size(
+            self.nof_tracks, self.nof_steps, self.version
+        )
+        with open(self.path, "r+b") as fout:
+            fout.truncate(HEADER.size + capacity * pattern_size)
+
+        self._map(self.readonly)
+
+    def _upgrade(self):
+        """Rewrite a version 1 file with default step locks"""
+        patterns = np.array(self._patterns[:self._count])
+        del self._slots, self._patterns, self._mm
+        self._write_empty(
+            self.path, self.nof_tracks, self.nof_steps, max(len(patterns), 1)
+        )
+        self._map(self.readonly)
+        for data in patterns:
+            self.append(data)
+
+    def capacity(self):
+        return len(self._patterns)
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if not -self._count <= index < self._count:
+            raise IndexError(f"No pattern {index} in {self.path}")
+
+        return self._patterns[index % self._count]
+
+    def locks(self, index):
+        """Step locks of pattern `index`, views like `self[index]`.
+
+        None for version 1 files, they hold no locks.
+        """
+        if not -self._count <= index < self._count:
+            raise IndexError(f"No pattern {index} in {self.path}")
+
+        if self.version == 1:
+            return None
+
+        slot = self._slots[index % self._count]
+        return {
+            name: slot[1 + block].view(LOCKS[name][0])
+            for block, name in enumerate(LOCK_BLOCKS)
+        }
+
+    def store(self, index, data, locks=None):
+        """Overwrite pattern `index`, `index == len(self)` appends.
+
+        Locks missing from `locks` are stored with their default value.
+        """
+        if self.readonly:
+            raise RuntimeError(f"{self.path} is opened read only")
+
+        if not 0 <= index <= self._count:
+            raise IndexError(f"No pattern {index} in {self.path}")
+
+        data = np.asarray(data, dtype=np.uint8)
+        if data.shape != (self.nof_tracks, self.nof_steps):
+            raise ValueError(
+                f"Pattern of shape {data.shape}, library stores "
+                f"{self.nof_tracks} x {self.nof_steps}"
+            )
+
+        if index >= self.capacity():
+            self._grow(max(2 * self.capacity(), 1))
+
+        self._patterns[index] = data
+        for block, name in enumerate(LOCK_BLOCKS):
+            dtype, default = LOCKS[name]
+            values = (locks or {}).get(name, default)
+            self._slots[index, 1 + block].view(dtype)[...] = values
+
+        if index == self._count:
+            self._count += 1
+            self._write_count()
+
+    def append(self, data, locks=None):
+        index = self._count
+        self.store(index, data, locks)
+        return index
+
+    def flush(self):
+        if not self.readonly:
+            self._mm.flush()
+
+    def close(self):
+        self.flush()
+        del self._slots, self._patterns, self._mm
+
+
+def save_pattern(path, data, locks=None):
+    """Write a single pattern in the library format"""
+    data = np.asarray(data, dtype=np.uint8)
+    library = PatternLibrary.create(path, *data.shape, capacity=1)
+    library.append(data, locks)
+    library.close()
+
+
+def load_pattern(path, nof_tracks=None, nof_steps=None):
+    """Read the first pattern of a library file"""
+    library = PatternLibrary(path, nof_tracks, nof_steps, readonly=True)
+    data = np.array(library[0])
+    library.close()
+    return data
@@ -0,0 +1,189 @@
+"""MIDI port backends.
+
+`RtMidiBackend` opens real ports through rtmidi. `LoopbackBackend` creates
+in-process ports with the same interface as `rtmidi.MidiIn`/`MidiOut`
+(`set_callback`, `send_message`, `ignore_types`, `get_message`,
+`close_port`...): a message sent to an output port named `X` is received,
+on the sender's thread, by every input port named `X`. `SimulatedController`
+plays a controller on top of it, pressing pads and keeping track of the LEDs
+the app lights.
+"""
+
+import time
+import threading
+import collections
+
+from rtmidi.midiutil import open_midiinput, open_midioutput
+from rtmidi.midiconstants import (
+    NOTE_ON, NOTE_OFF, SYSTEM_EXCLUSIVE, TIMING_CLOCK
+)
+
+ACTIVE_SENSING = 0xFE
+
+
+class RtMidiBackend(object):
+    """Real rtmidi ports, prompting for them when not given"""
+
+    def open_input(self, port=None, interactive=True):
+        return open_midiinput(port, interactive=interactive)
+
+    def open_output(self, port=None, interactive=True):
+        return open_midioutput(port, interactive=interactive)
+
+
+class LoopbackMidiIn(object):
+    def __init__(self, bus, name):
+        self.bus = bus
+        self.name = name
+        self._callback = None
+        self._data = None
+        self._pending = collections.deque()
+        self._last = None
+        self._open = True
+        # same defaults as rtmidi
+        self._ignore = dict(sysex=True, timing=True, active_sense=True)
+
+    def ignore_types(self, sysex=True, timing=True, active_sense=True):
+        self._ignore = dict(
+            sysex=sysex, timing=timing, active_sense=active_sense
+        )
+
+    def set_callback(self, func, data=None):
+        self._callback = func
+        self._data = data
+
+    def cancel_callback(self):
+        self._callback = None
+        self._data = None
+
+    def _ignored(self, message):
+        status = message[0]
+        return (
+            (self._ignore["sysex"] and status == SYSTEM_EXCLUSIVE) or
+            (self._ignore["timing"] and status == TIMING_CLOCK) or
+            (self._ignore["active_sense"] and status == ACTIVE_SENSING)
+        )
+
+    def _receive(self, message):
+        if not self._open or self._ignored(message):
+            return
+
+        now = time.monotonic()
+        delta = 0. if self._last is None else now - self._last
+        self._last = now
+        event = (list(message), delta)
+        # delivered on the sender's thread
+        if self._callback is not None:
+            self._callback(event, self._data)
+        else:
+            self._pending.append(event)
+
+    def get_message(self):
+        try:
+            return self._pending.popleft()
+        except IndexError:
+            return None
+
+    def is_port_open(self):
+        return self._open
+
+    def close_port(self):
+        self._open = False
+        self.bus.disconnect(self)
+
+
+class LoopbackMidiOut(object):
+    def __init__(self, bus, name):
+        self.bus = bus
+        self.name = name
+        self._open = True
+
+    def send_message(self, message):
+        if self._open:
+            self.bus.deliver(self.name, message)
+
+    def is_port_open(self):
+        return self._open
+
+    def close_port(self):
+        self._open = False
+
+
+def create_backend(name):
+    return {"rtmidi": RtMidiBackend, "loopback": LoopbackBackend}[name]()
+
+
+class LoopbackBackend(object):
+    """In-process ports connected by name, for tests and benchmarks"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inputs = collections.defaultdict(list)
+
+    def open_input(self, port=None, interactive=False):
+        name = "loopback" if port is None else port
+        midiin = LoopbackMidiIn(self, name)
+        with self._lock:
+            self._inputs[name].append(midiin)
+
+        return midiin, name
+
+    def open_output(self, port=None, interactive=False):
+        name = "loopback" if port is None else port
+        return LoopbackMidiOut(self, name), name
+
+    def deliver(self, name, message):
+        with self._lock:
+            inputs = list(self._inputs.get(name, []))
+
+        for midiin in inputs:
+            midiin._receive(message)
+
+    def disconnect(self, midiin):
+        with self._lock:
+            if midiin in self._inputs.get(midiin.name, []):
+                self._inputs[midiin.name].remove(midiin)
+
+
+class SimulatedController(object):
+    """A controller on a `LoopbackBackend`.
+
+    The app opens `input_name` as controller input and `output_name` as
+    controller output: pads pressed here reach the app's input, and LED
+    messages the app sends update `leds` (note -> velocity, 0 when off).
+    Bulk LED SysEx frames are decoded when given the `LedSysEx` format.
+    """
+
+    def __init__(self, backend, name="simulated", sysex=None):
+        self.sysex = sysex
+        self.input_name = f"{name}: pads"
+        self.output_name = f"{name}: leds"
+        self.pads_out, _ = backend.open_output(self.input_name)
+        self.led_in, _ = backend.open_input(self.output_name)
+        self.led_in.ignore_types(sysex=False)
+        self.led_in.set_callback(self._on_led)
+        self.leds = {}
+        self.led_messages = []
+
+    def _on_led(self, event, data=None):
+        message, _ = event
+        self.led_messages.append(message)
+        kind = message[0] & 0xF0
+        if kind == NOTE_ON:
+            self.leds[message[1]] = message[2]
+        elif kind == NOTE_OFF:
+            self.leds[message[1]] = 0
+        elif message[0] == SYSTEM_EXCLUSIVE and self.sysex is not None:
+            for note, color in self.sysex.unpack(message):
+                self.leds[note] = color
+
+    def send(self, message):
+        self.pads_out.send_message(message)
+
+    def press(self, note, velocity=127, channel=0, release=True):
+        self.send([NOTE_ON | channel, note, velocity])
+        if release:
+            self.send([NOTE_ON | channel, note, 0])
+
+    def lit(self, note):
+        return self.leds.get(note, 0) > 0
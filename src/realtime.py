@@ -0,0 +1,137 @@
+import os
+import time
+import ctypes
+import ctypes.util
+import logging
+
+
+log = logging.getLogger("Realtime")
+
+# from <sys/mman.h>
+MCL_CURRENT = 1
+MCL_FUTURE = 2
+
+POLICIES = {
+    "fifo": getattr(os, "SCHED_FIFO", None),
+    "rr": getattr(os, "SCHED_RR", None),
+}
+
+
+class RealtimeSettings(object):
+    """Scheduling policy, priority and CPU affinity for a group of threads.
+
+    Everything is best effort: when the platform or the privileges do not
+    allow a setting, it is logged and the thread keeps running as it was.
+    """
+
+    def __init__(self, policy=None, priority=50, cpus=None):
+        self.policy = policy
+        self.priority = priority
+        self.cpus = set(cpus) if cpus else None
+
+    def apply(self, thread, name=None):
+        """Apply to a started `threading.Thread`, return what was granted"""
+        name = thread.name if name is None else name
+        tid = thread.native_id
+        granted = {}
+        if tid is None:
+            log.warning(f"{name}: thread not started, nothing applied")
+            return granted
+
+        if self.policy is not None:
+            granted["policy"] = self._set_scheduler(tid, name)
+
+        if self.cpus is not None:
+            granted["cpus"] = self._set_affinity(tid, name)
+
+        return granted
+
+    def _set_scheduler(self, tid, name):
+        policy = POLICIES.get(self.policy, None)
+        if policy is None or not hasattr(os, "sched_setscheduler"):
+            log.warning(f"{name}: SCHED_{self.policy.upper()} not supported")
+            return None
+
+        try:
+            os.sched_setscheduler(
+                tid, policy, os.sched_param(self.priority)
+            )
+        except (OSError, ValueError) as err:
+            log.warning(
+                f"{name}: could not set SCHED_{self.policy.upper()} "
+                f"priority {self.priority} ({err}), keeping normal scheduling"
+            )
+            return None
+
+        log.info(
+            f"{name}: running SCHED_{self.policy.upper()} "
+            f"priority {self.priority}"
+        )
+        return self.policy
+
+    def _set_affinity(self, tid, name):
+        if not hasattr(os, "sched_setaffinity"):
+            log.warning(f"{name}: CPU affinity not supported")
+            return None
+
+        try:
+            os.sched_setaffinity(tid, self.cpus)
+        except (OSError, ValueError) as err:
+            log.warning(f"{name}: could not pin to CPUs {self.cpus} ({err})")
+            return None
+
+        cpus = os.sched_getaffinity(tid)
+        log.info(f"{name}: pinned to CPUs {sorted(cpus)}")
+        return cpus
+
+
+def lock_memory():
+    """mlockall current and future pages, return True when granted"""
+    libc_name = ctypes.util.find_library("c")
+    if libc_name is None:
+        log.warning("mlockall: libc not found, memory not locked")
+        return False
+
+    libc = ctypes.CDLL(libc_name, use_errno=True)
+    if not hasattr(libc, "mlockall"):
+        log.warning("mlockall: not available, memory not locked")
+        return False
+
+    if libc.mlockall(MCL_CURRENT | MCL_FUTURE) != 0:
+        err = ctypes.get_errno()
+        log.warning(f"mlockall: {os.strerror(err)}, memory not locked")
+        return False
+
+    log.info("mlockall: memory locked")
+    return True
+
+
+def wait_until(deadline, spin_ns=0, sleep=time.sleep):
+    """Wait for `deadline`, in `time.monotonic_ns()` time.
+
+    Sleeps with `sleep(seconds)` until `spin_ns` before the deadline, a
+    sleep that returns early is fine, and busy-waits the rest: the wake up
+    is as late as the OS makes it, the spin as exact as the clock.
+    """
+    remaining = deadline - time.monotonic_ns()
+    if remaining > spin_ns:
+        sleep((remaining - spin_ns) / 1e9)
+
+    while time.monotonic_ns() < deadline:
+        pass
+
+
+def parse_cpus(text):
+    """'0,2-3' -> {0, 2, 3}"""
+    if text is None or text.strip() == "":
+        return None
+
+    cpus = set()
+    for part in text.split(","):
+        if "-" in part:
+            start, end = part.split("-")
+            cpus.update(range(int(start), int(end) + 1))
+        else:
+            cpus.add(int(part))
+
+    return cpus
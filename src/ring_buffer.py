@@ -0,0 +1,109 @@
+import queue
+import threading
+import collections
+
+
+class RingBuffer(object):
+    """Bounded, low overhead alternative to `queue.Queue`.
+
+    Producers append to a deque (atomic, no lock) and only wake the consumer
+    when it may be sleeping. The consumer takes every pending item at once
+    with `drain`.
+
+    When full, the oldest item is dropped and counted, unless it is the
+    `None` stop sentinel, then the new item is. With `block`, producers wait
+    for room instead and raise `queue.Full` after `timeout` seconds.
+
+    `get`/`get_nowait` mimic `queue.Queue`, raising `queue.Empty`.
+    """
+
+    def __init__(self, maxlen=4096, block=False, timeout=1.0):
+        self.maxlen = maxlen
+        self.block = block
+        self.timeout = timeout
+        # blocking producers keep the bound themselves, the deque never
+        # evicts for them
+        self._items = collections.deque(maxlen=None if block else maxlen)
+        self._ready = threading.Event()
+        self._room = threading.Event()
+        self.depth_max = 0
+        self.dropped = 0
+
+    def put(self, item):
+        items = self._items
+        if len(items) >= self.maxlen:
+            if self.block:
+                self._wait_room()
+            elif items[0] is None:
+                # stopping, whatever comes after the sentinel is not read
+                self.dropped += 1
+                return
+            else:
+                self.dropped += 1
+
+        items.append(item)
+        depth = len(items)
+        if depth > self.depth_max:
+            self.depth_max = depth
+
+        if not self._ready.is_set():
+            self._ready.set()
+
+    def _wait_room(self):
+        items = self._items
+        while len(items) >= self.maxlen:
+            # cleared before testing: a consumer racing with us sets it again
+            self._room.clear()
+            if len(items) >= self.maxlen:
+                if not self._room.wait(self.timeout):
+                    raise queue.Full
+
+    def _made_room(self):
+        if self.block and not self._room.is_set():
+            self._room.set()
+
+    def _wait(self, timeout=None):
+        if not len(self._items):
+            self._ready.wait(timeout)
+
+        # cleared before popping: a put racing with us sets it again
+        self._ready.clear()
+
+    def drain(self, timeout=None):
+        """Wait for items (up to `timeout`) and return all of them"""
+        self._wait(timeout)
+        items = self._items
+        batch = []
+        while len(items):
+            batch.append(items.popleft())
+
+        self._made_room()
+        return batch
+
+    def get(self, block=True, timeout=None):
+        if block:
+            self._wait(timeout)
+
+        try:
+            item = self._items.popleft()
+        except IndexError:
+            raise queue.Empty
+
+        self._made_room()
+        return item
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def qsize(self):
+        return len(self._items)
+
+    def empty(self):
+        return not len(self._items)
+
+    def metrics(self):
+        return dict(
+            depth=len(self._items),
+            depth_max=self.depth_max,
+            dropped=self.dropped,
+        )
@@ -1,8 +1,21 @@
 import math
+import time
+import random
+import fractions
+import logging
+import threading
+import contextlib
 import mido
+import numpy as np
 
 from track import Track
-from modes import TrackMode, TrackSelectMode
+from pattern import Pattern, LOCKS, LOCK_RANGES
+from note_off import NoteOffWheel, note_off
+from banks import BankSet
+from latency import probe
+from modes import TrackMode, TrackSelectMode, CommitMode
+
+log = logging.getLogger("Sequencer")
 
 
 # ToDo :=
@@ -26,6 +39,22 @@ from modes import TrackMode, TrackSelectMode
 # - nof_displayed_tracks
 # - led_channel
 # - led_colors
+# - lookahead (optional): steps computed ahead of time, needs an output queue
+#   with `schedule` (ScheduledOutputQueue)
+# - bpm (optional): initial tempo estimate for lookahead timestamps
+# - pattern_commit (optional): when edits reach the output, see CommitMode
+# - nof_banks (optional): preloaded patterns to switch between, see
+#   `queue_bank` and `set_song`
+# - song (optional): [[bank, repeats], ...] chain played from start
+# - track_lengths (optional): steps of each track, up to nof_steps
+# - track_rates (optional): steps each track plays per sequencer step, i.e.:
+#   "3/4" or 2
+# - step_locks (optional): per step probability, ratchets, micro-timing and
+#   gate, played on the 24 PPQN pulses
+# - seed (optional): random seed for step probabilities
+# - gate_pulses (optional): note length in clock pulses, 0 sends no
+#   note-offs
+# - track_gates (optional): gate_pulses for each track
 class Sequencer(object):
     def __init__(
         self,
@@ -38,16 +67,107 @@ class Sequencer(object):
         self.output_channel = config["output_channel"]
         self.nof_tracks = config["nof_tracks"]
         self.nof_steps = config["nof_steps"]
-        self.track_select_map = config.get("track_select_map", [])
+        self.track_select_map = config.get("track_select_map", None) or []
         self.track_select_mode = config["track_select_mode"]
         self.note_input_map = config["note_input_map"]
-        self.note_output_map = config["note_output_map"]
+        self._note_output_map = config["note_output_map"]
 
         self.output_queue = output_queue
+        self.led_queue = led_queue
+        self.lookahead = config.get("lookahead", 0)
+        # one step spans 4 / nof_steps quarter notes
+        self._nominal_step_ns = int(
+            (60e9 / config.get("bpm", 120)) * (4 / self.nof_steps)
+        )
+        self._step_ns = self._nominal_step_ns
+        self._step_time = None
+        self._last_tick_time = None
 
         self._display_index = 0
         self._current_beat = 0
+        # polymetric tracks play on the 24 PPQN pulses, see `_build_polymetry`
+        self.step_pulses = int((4 / self.nof_steps) * 24)
+        self.track_lengths = (
+            config.get("track_lengths", None) or
+            [self.nof_steps] * self.nof_tracks
+        )
+        self.track_rates = [
+            fractions.Fraction(str(rate))
+            for rate in (
+                config.get("track_rates", None) or [1] * self.nof_tracks
+            )
+        ]
+        self.polymetric = (
+            any(length != self.nof_steps for length in self.track_lengths) or
+            any(rate != 1 for rate in self.track_rates)
+        )
+        self.track_gates = (
+            config.get("track_gates", None) or
+            [config.get("gate_pulses", 0)] * self.nof_tracks
+        )
+        if len(self.track_gates) != self.nof_tracks or any(
+            int(gate) != gate or gate < 0 for gate in self.track_gates
+        ):
+            raise ValueError(
+                f"track_gates needs {self.nof_tracks} pulse counts >= 0, "
+                f"got {self.track_gates}"
+            )
+
+        # note-offs pending on the next pulses, a slot for the longest gate,
+        # step locks hold gates up to 255 pulses
+        self._note_offs = NoteOffWheel(max(self.track_gates + [255]) + 1)
+        self._note_gates = {}
+        self.step_locks = config.get("step_locks", False)
+        # steps go out on `pulse` instead of `tick`
+        self.pulse_mode = self.polymetric or self.step_locks
+        self.rng = random.Random(config.get("seed", None))
+        # last pulse played since start, -1 before the first one
+        self._pulse = -1
+        self._poly_tables = None
+        self._poly_plan = None
+        self._track_pulses = [self.step_pulses] * self.nof_tracks
+        self._track_periods = [
+            self.step_pulses * self.nof_steps
+        ] * self.nof_tracks
+        if self.pulse_mode:
+            self._build_polymetry()
+            if self.lookahead > 0:
+                log.warning(
+                    "Lookahead is not supported by polymetric tracks and "
+                    "step locks"
+                )
+                self.lookahead = 0
+
+        self._note_index = {}
+        self.pattern = Pattern(self.nof_tracks, self.nof_steps)
+        # 0xFF for tracks that sound, 0x00 otherwise, ANDed with a column
+        self._active_mask = np.full(self.nof_tracks, 0xFF, dtype=np.uint8)
+        # ready to send messages for each step, see `_compile_steps`. The
+        # front table is only read by tick, edits build a pending (back) copy
+        # that gets swapped in on a commit
+        self.pattern_commit = CommitMode(
+            config.get("pattern_commit", CommitMode.immediate)
+        )
+        self._step_output = [[] for _ in range(self.nof_steps)]
+        self._pending_output = None
+        # held by pattern edits and bank switches, so an edit never lands in
+        # a bank being switched away. Reentrant, edits compile under it
+        self._pending_lock = threading.RLock()
+        # pattern banks and the bank chain, see `BankSet`
+        self.nof_banks = config.get("nof_banks", 1)
+        self.banks = BankSet(
+            self.nof_banks,
+            self.nof_tracks,
+            self.nof_steps,
+            self._build_bank_tables,
+        )
+        self._ticked = False
         self._setup_tracks(led_queue)
+        self._build_note_index()
+        self._build_note_gates()
+        self._compile_steps()
+        if config.get("song", None):
+            self.set_song(config["song"])
 
         if (
             self.track_mode != TrackMode.all_tracks and
@@ -78,52 +198,257 @@ class Sequencer(object):
 
     def _setup_tracks(self, led_queue):
         self.tracks = []
-        for track_id in range(self.nof_tracks):
-            if self.track_select_mode == TrackMode.all_tracks:
-                select = True
-            elif track_id < self.config["nof_displayed_tracks"]:
-                select = True
-            else:
-                select = False
-
-            # ToDo := notes map
-            track = Track(
-                track_id=track_id,
-                config=self.config,
-                note_input_map=self._track_note_map_from_id(track_id),
-                led_queue=led_queue,
-                select=select,
+        with self._led_frame():
+            for track_id in range(self.nof_tracks):
+                if self.track_select_mode == TrackMode.all_tracks:
+                    select = True
+                elif track_id < self.config["nof_displayed_tracks"]:
+                    select = True
+                else:
+                    select = False
+
+                # ToDo := notes map
+                track = Track(
+                    track_id=track_id,
+                    config=self.config,
+                    note_input_map=self._track_note_map_from_id(track_id),
+                    led_queue=led_queue,
+                    select=select,
+                    state=self.pattern.row(track_id),
+                    on_mix_change=self._update_active_mask,
+                    on_step_change=self._compile_step,
+                    lock=self._pending_lock,
+                )
+                self.tracks.append(track)
+
+        self._update_active_mask()
+
+    def _build_polymetry(self):
+        """Precompute each track's steps over its own period.
+
+        A track period is `length` steps of `step_pulses / rate` pulses.
+        `_poly_tables[track][pulse % period]` holds one `(step, phase,
+        next_step, next_phase)` entry: the events of `step` due `phase`
+        pulses after it started and those of `next_step` played early.
+        Tables grow with the track lengths, not with their common multiple,
+        and a pulse costs the same whatever the lengths and rates are.
+        """
+        if len(self.track_lengths) != self.nof_tracks or \
+                len(self.track_rates) != self.nof_tracks:
+            raise ValueError(
+                "track_lengths and track_rates need one value for each of "
+                f"the {self.nof_tracks} tracks"
             )
-            self.tracks.append(track)
 
-    def _get_midimsgs_from_tracks(self):
-        msgs = []
-        tracks = [tr for tr in self.tracks if tr.solo]
-        if len(tracks) == 0:
-            tracks = [tr for tr in self.tracks if not tr.mute]
-
-        for tr in tracks:
-            step_val = tr.get_state()[self._current_beat]
-            if step_val > 0:
-                track_id = tr.track_id
-                track_msg = mido.Message(
-                    type="note_on",
-                    note=self.note_output_map[track_id],
-                    velocity=step_val,
-                    channel=self.output_channel
+        track_pulses = []
+        for track_id, (length, rate) in enumerate(
+            zip(self.track_lengths, self.track_rates)
+        ):
+            pulses = self.step_pulses / rate
+            if not 0 < length <= self.nof_steps or rate <= 0:
+                raise ValueError(
+                    f"Track {track_id}: length {length} not in "
+                    f"[1, {self.nof_steps}] or invalid rate {rate}"
+                )
+
+            if pulses.denominator != 1:
+                raise ValueError(
+                    f"Track {track_id}: rate {rate} does not fall on clock "
+                    f"pulses, {self.step_pulses} pulses per step"
+                )
+
+            track_pulses.append(int(pulses))
+
+        self._track_pulses = track_pulses
+        self._track_periods = [
+            pulses * length
+            for pulses, length in zip(track_pulses, self.track_lengths)
+        ]
+        self._poly_tables = []
+        for pulses, length in zip(track_pulses, self.track_lengths):
+            steps = [pulse // pulses for pulse in range(pulses * length)]
+            self._poly_tables.append([
+                (
+                    step,
+                    pulse % pulses,
+                    (step + 1) % length,
+                    pulse % pulses - pulses,
+                )
+                for pulse, step in enumerate(steps)
+            ])
+
+        self._poly_plan = list(enumerate(
+            zip(self._poly_tables, self._track_periods)
+        ))
+
+    def track_step(self, track_id):
+        """Step of `track_id` playing on the last pulse"""
+        if not self.polymetric:
+            return self._current_beat
+
+        pulse = max(self._pulse, 0) % self._track_periods[track_id]
+        return self._poly_tables[track_id][pulse][0]
+
+    def _update_active_mask(self):
+        # tracks are still being built
+        if len(self.tracks) < self.nof_tracks:
+            return
+
+        solo = np.array([tr.solo for tr in self.tracks], dtype=bool)
+        if solo.any():
+            active = solo
+        else:
+            active = ~np.array([tr.mute for tr in self.tracks], dtype=bool)
+
+        self._active_mask = np.where(active, 0xFF, 0x00).astype(np.uint8)
+        self._compile_steps()
+        self.banks.invalidate()
+
+    def _build_note_gates(self):
+        self._note_gates = {
+            note: gate
+            for note, gate in zip(self.note_output_map, self.track_gates)
+            if gate > 0
+        }
+
+    @property
+    def note_output_map(self):
+        return self._note_output_map
+
+    @note_output_map.setter
+    def note_output_map(self, value):
+        self._note_output_map = value
+        self._build_note_gates()
+        self._compile_steps()
+        self.banks.invalidate()
+
+    def _compile_step(self, step):
+        self._compile_steps([step])
+
+    def _compile_steps(self, steps=None):
+        """Rebuild the output messages of `steps` (all by default).
+
+        Messages are built into the pending table, which is committed right
+        away or on the next step/bar boundary depending on `pattern_commit`.
+        Message lists are replaced, never mutated, so a batch already handed
+        to the output queue is left untouched.
+        """
+        steps = range(self.nof_steps) if steps is None else steps
+        with self._pending_lock:
+            if self._pending_output is None:
+                self._pending_output = list(self._step_output)
+
+            for step in steps:
+                self._pending_output[step] = \
+                    self._get_midimsgs_from_tracks(step)
+
+        if self.pattern_commit == CommitMode.immediate:
+            self._commit()
+
+    def _commit(self, blocking=True):
+        """Swap the pending table in, a single reference assignment.
+
+        The tick path does not block: if an edit is being built the commit
+        is left for the next boundary.
+        """
+        if not self._pending_lock.acquire(blocking):
+            return
+
+        try:
+            if self._pending_output is not None:
+                self._step_output = self._pending_output
+                self._pending_output = None
+        finally:
+            self._pending_lock.release()
+
+    def _commit_on_boundary(self):
+        if (
+            self.pattern_commit == CommitMode.step or
+            (
+                self.pattern_commit == CommitMode.bar and
+                self._current_beat == 0
+            )
+        ):
+            self._commit(blocking=False)
+
+    def _get_midimsgs_from_tracks(self, step=None):
+        step = self._current_beat if step is None else step
+        return self._messages_from_column(
+            self.pattern.column(step), self.pattern.lock_column(step)
+        )
+
+    def _step_events(self, track_id, msg, locks):
+        """`{phase: [(msg, probability, gate), ...]}` of a step.
+
+        Phases are pulses since the step started, ratchets split the step
+        evenly, negative phases play before the step starts.
+        """
+        if locks is None:
+            return {0: [(msg, 100, self.track_gates[track_id])]}
+
+        pulses = self._track_pulses[track_id]
+        ratchets = max(1, min(int(locks["ratchets"][track_id]), pulses))
+        spacing = pulses // ratchets
+        # ratchets must not spill over the next step
+        last = (ratchets - 1) * spacing
+        micro = min(
+            max(int(locks["micro"][track_id]), 1 - pulses), pulses - 1 - last
+        )
+        event = (
+            msg,
+            int(locks["probability"][track_id]),
+            int(locks["gate"][track_id]) or self.track_gates[track_id],
+        )
+        events = {}
+        for ratchet in range(ratchets):
+            events.setdefault(micro + ratchet * spacing, []).append(event)
+
+        return events
+
+    def _messages_from_column(self, column, locks=None):
+        """Messages of the tracks sounding in `column`.
+
+        In pulse mode (polymetric tracks or step locks) tracks play
+        different steps at once, there the result holds one
+        `_step_events` dict (or None) per track instead.
+        """
+        locks = locks if self.step_locks else None
+        msgs = [None] * self.nof_tracks if self.pulse_mode else []
+        column = column & self._active_mask
+        for track_id in np.flatnonzero(column):
+            track_msg = mido.Message(
+                type="note_on",
+                note=self.note_output_map[track_id],
+                velocity=int(column[track_id]),
+                channel=self.output_channel
+            )
+            if self.pulse_mode:
+                msgs[track_id] = self._step_events(
+                    track_id, track_msg.bytes(), locks
                 )
+            else:
                 msgs.append(track_msg.bytes())
         return msgs
 
-    def _track_id_from_note_map(self, note):
-        track_id = self.note_input_map.index(note)
-        track_id = math.floor(track_id / self.nof_steps)
-        return track_id + self._first_selected_track_id()
+    def _build_note_index(self):
+        """Map every input note to its action in a single table.
+
+        Values are `(track_id, step_id)` for step pads and
+        `(None, select_id)` for track selection pads, the latter take
+        precedence. Track ids depend on the displayed tracks, so the table
+        is rebuilt whenever the selection changes.
+        """
+        index = {}
+        first_track_id = self._first_selected_track_id()
+        for note_id, note in enumerate(self.note_input_map):
+            track_id = math.floor(note_id / self.nof_steps) + first_track_id
+            if note not in index and track_id < self.nof_tracks:
+                index[note] = (track_id, note_id % self.nof_steps)
+
+        for select_id, note in enumerate(self.track_select_map):
+            index[note] = (None, select_id)
 
-    def _step_id_from_note_map(self, note):
-        step_id = self.note_input_map.index(note)
-        step_id = step_id % self.nof_steps
-        return step_id
+        self._note_index = index
 
     def _is_select_up(self, note):
         return note == self.track_select_map[0]
@@ -147,13 +472,18 @@ class Sequencer(object):
         for idx in unselect:
             self.tracks[idx].select = False
 
-        for idx in track_ids:
-            self.tracks[idx].select = True
+        with self._led_frame():
+            for idx in track_ids:
+                self.tracks[idx].select = True
+
+        self._build_note_index()
+        # prepared LED tables show the previous selection
+        self.banks.invalidate()
 
     def _toggle_select_track(self, note):
         if self.track_select_mode == TrackSelectMode.select:
             # direct track selection through button
-            track_id = self.track_select_map.index(note)
+            _, track_id = self._note_index[note]
             self._select_single_track(track_id)
         else:
             # up/down arrows
@@ -174,15 +504,193 @@ class Sequencer(object):
 
                 self._select_tracks(select_ids)
 
+    def _led_frame(self):
+        """Group LED writes into one frame when the led queue supports it"""
+        hold = getattr(self.led_queue, "hold", None)
+        return hold() if hold is not None else contextlib.nullcontext()
+
+    def _propagate_tracks(self):
+        with self._led_frame():
+            for tr in self.tracks:
+                tr.propagate()
+
+    # Bulk pattern edits, track_ids=None works on every track
+    def clear_pattern(self, track_ids=None):
+        with self._pending_lock:
+            self.pattern.clear(track_ids)
+            self._compile_steps()
+        self._propagate_tracks()
+
+    def shift_pattern(self, amount, track_ids=None):
+        with self._pending_lock:
+            self.pattern.shift(amount, track_ids)
+            self._compile_steps()
+        self._propagate_tracks()
+
+    def randomize_pattern(
+        self, density=0.25, velocity=127, track_ids=None, rng=None
+    ):
+        with self._pending_lock:
+            self.pattern.randomize(density, velocity, track_ids, rng)
+            self._compile_steps()
+        self._propagate_tracks()
+
+    def copy_track(self, src_track_id, dst_track_id):
+        with self._pending_lock:
+            self.pattern.copy_track(src_track_id, dst_track_id)
+            self._compile_steps()
+        self.tracks[dst_track_id].propagate()
+
+    def load_pattern(self, data, locks=None):
+        """Replace every step with `data`, a tracks x steps array"""
+        with self._pending_lock:
+            self.pattern.load(data, locks)
+            self._compile_steps()
+        self._propagate_tracks()
+
+    # Pattern banks, see `BankSet`
+    @property
+    def current_bank(self):
+        return self.banks.current
+
+    @property
+    def song(self):
+        return self.banks.song
+
+    def get_bank(self, index):
+        if index == self.current_bank:
+            return self.pattern.data
+
+        return self.banks.get_data(index)
+
+    def get_bank_locks(self, index):
+        if index == self.current_bank:
+            return self.pattern.locks
+
+        return self.banks.get_locks(index)
+
+    def store_bank(self, index, data=None, locks=None):
+        """Store a pattern in bank `index`, the playing one by default"""
+        if data is None:
+            data, locks = self.pattern.data, self.pattern.locks
+
+        if index == self.current_bank:
+            self.load_pattern(data, locks)
+        else:
+            with self._pending_lock:
+                self.banks.store(index, data, locks)
+
+    def attach_bank(self, index, data, locks=None):
+        """Read bank `index` from views, i.e.: a `PatternLibrary` slot.
+
+        Nothing is copied until the bank plays, the playing bank loads
+        them right away.
+        """
+        with self._pending_lock:
+            self.banks.attach(index, data, locks)
+            if index == self.current_bank:
+                self.load_pattern(data, self.banks.get_locks(index))
+
+    def queue_bank(self, index, data=None, locks=None):
+        """Switch to bank `index` on the next bar.
+
+        With `data` (and `locks`) the bank plays that pattern, i.e.: switch
+        to a library slot mid-set with
+        `queue_bank(0, library[n], library.locks(n))`.
+        """
+        with self._pending_lock:
+            self.banks.queue(index, data, locks)
+
+    def set_song(self, song, loop=True):
+        """Chain `[(bank, repeats), ...]`, from the next bar or start"""
+        self.banks.set_song(song, loop)
+
+    def _build_bank_tables(self, data, locks):
+        output = [
+            self._messages_from_column(
+                data[:, step],
+                {name: lock[:, step] for name, lock in locks.items()},
+            )
+            for step in range(self.nof_steps)
+        ]
+        leds = []
+        for tr in self.tracks:
+            if tr.displayed():
+                leds.extend(tr.led_messages(state=data[tr.track_id]))
+
+        return output, leds
+
+    def _switch_bank(self, index):
+        tables = self.banks.tables.pop(index, None)
+        with self._pending_lock:
+            if not self.banks.reload:
+                self.banks.write(
+                    self.current_bank, self.pattern.data, self.pattern.locks
+                )
+
+            self.banks.reload = False
+            self.pattern.load(
+                self.banks.get_data(index), self.banks.get_locks(index)
+            )
+            self._pending_output = None
+            if tables is not None:
+                self._step_output = tables[0]
+
+        # tables of the bank left behind are now out of date
+        self.banks.tables.pop(self.current_bank, None)
+        self.banks.current = index
+        if tables is None:
+            log.warning(f"Bank {index} was not ready, built on the tick")
+            self._compile_steps()
+            self._commit()
+            self._propagate_tracks()
+        elif len(tables[1]):
+            self.led_queue(tables[1])
+
+    def _on_bar(self):
+        reload = self.banks.reload
+        target = self.banks.next_bar()
+        if target is not None and (target != self.current_bank or reload):
+            self._switch_bank(target)
+
+        self.banks.prepare_upcoming()
+
+    def _upcoming_output(self):
+        tables = self.banks.upcoming_tables()
+        return self._step_output if tables is None else tables[0]
+
+    def set_step_lock(self, track_id, step, **locks):
+        """Set parameter locks of a step, i.e.: `ratchets=3, micro=-2`"""
+        for name, value in locks.items():
+            if name not in LOCKS:
+                raise ValueError(
+                    f"Unknown step lock {name}, choose from {list(LOCKS)}"
+                )
+
+            low, high = LOCK_RANGES[name]
+            if int(value) != value or not low <= value <= high:
+                raise ValueError(
+                    f"Step lock {name} {value} not in [{low}, {high}]"
+                )
+
+        with self._pending_lock:
+            for name, value in locks.items():
+                self.pattern.locks[name][track_id, step] = value
+
+            self._compile_step(step)
+
     def get_track_state(self, track_id):
         return self.tracks[track_id].get_state()
 
-    def get_all_track_states(self, track_id):
+    def get_all_track_states(self, track_id=None):
         return [tr.get_state() for tr in self.tracks]
 
     # Process track events
     def process(self, message):
         # print(f"Sequencer: {message}")
+        if probe.enabled and probe.origin is not None:
+            probe.record("input_sequencer", probe.origin)
+
         if message.type in ["note_on", "note_off"]:
             note = message.note
             value = message.velocity
@@ -190,24 +698,183 @@ class Sequencer(object):
             note = message.control
             value = message.value
 
-        if note in self.track_select_map:
+        action = self._note_index.get(note, None)
+        if action is None:
+            return
+
+        target_track_id, step_id = action
+        if target_track_id is None:
             if self.track_mode == TrackMode.select_tracks:
                 self._toggle_select_track(note)
-        elif note in self.note_input_map:
-            target_track_id = self._track_id_from_note_map(note)
-            step_id = self._step_id_from_note_map(note)
+        else:
             self.tracks[target_track_id](step_id, value)
 
-    # Step the sequencer
-    def tick(self):
+    def process_batch(self, messages):
+        # a burst of edits lights the pads in a single frame
+        with self._led_frame():
+            for message in messages:
+                self.process(message)
+
+    def _update_step_time(self, now):
+        """Track the expected time of the current step.
+
+        The step interval follows the measured tick period, the step time
+        advances on that grid so callback jitter does not leak into the
+        timestamps. Jumps larger than half a step re-anchor the grid.
+        """
+        if self._last_tick_time is not None:
+            measured = now - self._last_tick_time
+            self._step_ns += (measured - self._step_ns) // 8
+
+        self._last_tick_time = now
+        if self._step_time is not None:
+            self._step_time += self._step_ns
+            if abs(now - self._step_time) > self._step_ns // 2:
+                self._step_time = now
+        else:
+            self._step_time = now
+
+    def _schedule_ahead(self, late=0):
+        first = self._step_time is None
+        # anchor on the clock event arrival, not on when we got to run
+        self._update_step_time(time.monotonic_ns() - late)
+        # on the first tick fill the whole lookahead window
+        offsets = range(self.lookahead + 1) if first else [self.lookahead]
+        for offset in offsets:
+            step = self._current_beat + offset
+            # steps past the bar come from the bank playing next
+            if step < self.nof_steps:
+                msgs = self._step_output[step]
+            else:
+                msgs = self._upcoming_output()[step % self.nof_steps]
+            if len(msgs):
+                timestamp = self._step_time + offset * self._step_ns
+                self.output_queue.schedule(timestamp, msgs)
+                self._schedule_note_offs(timestamp, msgs)
+
+    def _schedule_note_offs(self, timestamp, msgs):
+        pulse_ns = self._step_ns // self.step_pulses
+        note_offs = {}
+        for msg in msgs:
+            gate = self._note_gates.get(msg[1], 0)
+            if gate > 0:
+                note_offs.setdefault(gate, []).append(note_off(msg))
+
+        for gate, offs in note_offs.items():
+            self.output_queue.schedule(timestamp + gate * pulse_ns, offs)
+
+    def _reset_timing(self):
+        self._step_ns = self._nominal_step_ns
+        self._step_time = None
+        self._last_tick_time = None
+
+    # Step the sequencer, `late` is the clock dispatch delay in ns
+    def tick(self, late=0):
         # pass
         # print("tick")
-        msgs = self._get_midimsgs_from_tracks()
-        self.output_queue.put(msgs)
+        if self._current_beat == 0 and self._ticked:
+            self._on_bar()
+
+        self._ticked = True
+        self._commit_on_boundary()
+        if self.lookahead > 0:
+            # pad edits inside the lookahead window sound on the next loop
+            self._schedule_ahead(late)
+        elif not self.pulse_mode:
+            msgs = self._step_output[self._current_beat]
+            if len(self._note_gates) and len(msgs):
+                msgs = self._gate_notes(
+                    [(msg, self._note_gates.get(msg[1], 0)) for msg in msgs]
+                )
+
+            self.output_queue.put(msgs)
+        # else steps go out on `pulse`
+
         self._current_beat = (self._current_beat + 1) % self.nof_steps
 
+    def _due_events(self):
+        """`(msg, gate)` of the events due on the current pulse"""
+        table = self._step_output
+        due = []
+        for track_id, (steps, period) in self._poly_plan:
+            step, phase, next_step, next_phase = steps[self._pulse % period]
+            events = table[step][track_id]
+            if events is not None and phase in events:
+                due.extend(events[phase])
+
+            events = table[next_step][track_id]
+            if events is not None and next_phase in events:
+                due.extend(events[next_phase])
+
+        return [
+            (msg, gate) for msg, probability, gate in due
+            if probability >= 100 or self.rng.random() * 100 < probability
+        ]
+
+    def _gate_notes(self, events):
+        """Schedule the note-offs of `(msg, gate)` events, return messages.
+
+        A note still sounding is ended right before it is played again.
+        """
+        msgs = []
+        for msg, gate in events:
+            if gate > 0:
+                pending = self._note_offs.cancel((msg[0] & 0x0F, msg[1]))
+                if pending is not None:
+                    msgs.append(pending)
+
+                self._note_offs.schedule(gate, note_off(msg))
+
+            msgs.append(msg)
+
+        return msgs
+
+    def pulse(self, late=0):
+        """Send the due note-offs, and the due steps in pulse mode"""
+        msgs = self._note_offs.pop()
+        if self.pulse_mode:
+            self._pulse += 1
+            msgs.extend(self._gate_notes(self._due_events()))
+
+        self._note_offs.advance()
+
+        if len(msgs):
+            self.output_queue.put(msgs)
+
     def start(self):
-        self._current_beat = 0
+        self.resume(0)
+
+    def resume(self, song_pulses):
+        """Play on from `song_pulses` clock pulses after the song start.
+
+        Steps, polymetric tracks and the bank chain are where a start
+        `song_pulses` pulses ago would have brought them. A position inside
+        a step resumes on the next one.
+        """
+        bars, offset = divmod(song_pulses, self.step_pulses * self.nof_steps)
+        self._current_beat = -(-offset // self.step_pulses) % self.nof_steps
+        self._pulse = song_pulses - 1
+        # past the bar start, the next step 0 starts a new bar
+        self._ticked = offset > 0
+        self._reset_timing()
+        if len(self.song):
+            bank = self.banks.seek_song(bars)
+            if bank != self.current_bank:
+                self._switch_bank(bank)
+
+            self.banks.prepare_upcoming()
+
+        self._commit()
 
     def stop(self):
         self._current_beat = 0
+        self._pulse = -1
+        # no note left hanging
+        msgs = self._note_offs.flush()
+        if len(msgs):
+            self.output_queue.put(msgs)
+
+        if self.lookahead > 0:
+            self.output_queue.cancel_pending()
+
+        self._reset_timing()
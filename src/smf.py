@@ -0,0 +1,95 @@
+import struct
+
+# meta events
+META = 0xFF
+META_TEMPO = 0x51
+META_TIME_SIGNATURE = 0x58
+META_END_OF_TRACK = 0x2F
+
+
+def var_len(value):
+    """SMF variable length quantity, 7 bits per byte, MSB first"""
+    out = bytearray([value & 0x7F])
+    value >>= 7
+    while value:
+        out.insert(0, 0x80 | (value & 0x7F))
+        value >>= 7
+
+    return bytes(out)
+
+
+class SmfWriter(object):
+    """Streams a single track (format 0) Standard MIDI File to disk.
+
+    Events are written as they come, the track chunk length is patched in on
+    `close`, so memory use does not grow with the song length. Event times
+    must not go backwards.
+
+        with SmfWriter("out.mid", bpm=120) as smf:
+            smf.write(time_ns, [0x90, 36, 127])
+    """
+
+    def __init__(self, path, bpm=120, division=480, time_signature=(4, 4)):
+        self.path = path
+        self.bpm = bpm
+        # (numerator, denominator), the denominator a power of two
+        self.time_signature = time_signature
+        # ticks per quarter note
+        self.division = division
+        self._quarter_ns = 60e9 / bpm
+        self._last_tick = 0
+        self._length_pos = None
+        self._track_start = None
+        self._fout = open(path, "wb")
+        self._write_header()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _write_header(self):
+        # format 0, one track
+        header = struct.pack(">IHHH", 6, 0, 1, self.division)
+        self._fout.write(b"MThd" + header)
+        self._fout.write(b"MTrk")
+        self._length_pos = self._fout.tell()
+        # placeholder, see `close`
+        self._fout.write(struct.pack(">I", 0))
+        self._track_start = self._fout.tell()
+        tempo = int(round(self._quarter_ns / 1e3))
+        self._write_event(0, bytes(
+            [META, META_TEMPO, 3]) + tempo.to_bytes(3, "big")
+        )
+        # metronome click on every denominator note, 8 32nds per quarter
+        numerator, denominator = self.time_signature
+        self._write_event(0, bytes([
+            META, META_TIME_SIGNATURE, 4, numerator,
+            denominator.bit_length() - 1, 96 // denominator, 8
+        ]))
+
+    def ticks(self, time_ns):
+        return int(round(time_ns * self.division / self._quarter_ns))
+
+    def _write_event(self, tick, data):
+        delta = max(tick - self._last_tick, 0)
+        self._last_tick = max(tick, self._last_tick)
+        self._fout.write(var_len(delta) + data)
+
+    def write(self, time_ns, message):
+        """Write a channel message (status byte first) at `time_ns`"""
+        self._write_event(self.ticks(time_ns), bytes(message))
+
+    def close(self, time_ns=None):
+        """End the track at `time_ns`, or at the last event"""
+        if self._fout is None:
+            return
+
+        tick = self._last_tick if time_ns is None else self.ticks(time_ns)
+        self._write_event(tick, bytes([META, META_END_OF_TRACK, 0]))
+        end = self._fout.tell()
+        self._fout.seek(self._length_pos)
+        self._fout.write(struct.pack(">I", end - self._track_start))
+        self._fout.close()
+        self._fout = None
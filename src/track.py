@@ -1,4 +1,6 @@
 import mido
+import contextlib
+import numpy as np
 
 from modes import NoteMode, LedMode, LedColors, TrackMode
 
@@ -14,6 +16,10 @@ class Track(object):
         select=False,
         mute=False,
         solo=False,
+        state=None,
+        on_mix_change=None,
+        on_step_change=None,
+        lock=None,
     ):
         led_config = config["led_config"]
         self.config = config
@@ -26,6 +32,11 @@ class Track(object):
         self._select = select
         self._mute = mute
         self._solo = solo
+        # notified on mute/solo changes and on step edits
+        self._on_mix_change = on_mix_change
+        self._on_step_change = on_step_change
+        # held while a step is written and compiled, see `Sequencer`
+        self._lock = contextlib.nullcontext() if lock is None else lock
 
         self.track_mode = config.get("track_mode", TrackMode.select_tracks)
         self.note_mode = config.get("note_mode", NoteMode.toggle)
@@ -51,15 +62,23 @@ class Track(object):
         elif self.led_color_mode == LedColors.velocity:
             self.track_velocity = led_config["led_colors"][self.track_id]
 
-        self.state = [0] * self.nof_steps
+        # usually a row view of the sequencer's Pattern
+        if state is None:
+            state = np.zeros(self.nof_steps, dtype=np.uint8)
+
+        self.state = state
         # light off leds
         self.propagate()
 
     def __call__(self, step, value):
-        if self.note_mode == NoteMode.toggle:
-            self.state[step] = 127 - self.state[step]
-        else:
-            self.state[step] = value
+        with self._lock:
+            if self.note_mode == NoteMode.toggle:
+                self.state[step] = 127 - self.state[step]
+            else:
+                self.state[step] = value
+
+            if self._on_step_change is not None:
+                self._on_step_change(step)
 
         self.propagate(step)
 
@@ -83,6 +102,9 @@ class Track(object):
         if self._mute:
             self._solo = False
 
+        if self._on_mix_change is not None:
+            self._on_mix_change()
+
     @property
     def solo(self):
         return self._solo
@@ -93,13 +115,17 @@ class Track(object):
         if self._solo:
             self._mute = False
 
+        if self._on_mix_change is not None:
+            self._on_mix_change()
+
     def get_state(self):
         return self.state
 
-    def step_ids_to_led_messages(self, step_ids):
+    def step_ids_to_led_messages(self, step_ids, state=None):
+        state = self.state if state is None else state
         messages = []
         for id in step_ids:
-            value = self.state[id]
+            value = state[id]
             if self.led_color_mode == LedColors.velocity and value > 0:
                 value = self.track_velocity
 
@@ -113,35 +139,40 @@ class Track(object):
 
         return messages
 
-    def propagate(self, target_step=None):
+    def displayed(self):
+        return len(self.led_output_map) > 0 and (
+            self.track_mode != TrackMode.select_tracks or self.select
+        )
+
+    def led_messages(self, target_step=None, state=None):
+        """LED messages showing `state` (the track's by default)"""
+        state = self.state if state is None else state
         # Light Modes: see class
-        if (
-            len(self.led_output_map) > 0 and
-            (
-                self.track_mode != TrackMode.select_tracks or
-                self.select
-            )
-        ):
-            messages = []
-            if self.led_mode == LedMode.handled:
-                if target_step is None:
-                    step_ids = list(range(len(self.state)))
-                else:
-                    step_ids = [target_step]
-
-                messages = self.step_ids_to_led_messages(step_ids)
-            elif self.led_mode == LedMode.partial_handled:
-                # only note-offs
-                if target_step is None:
-                    step_ids = [st for st in self.state if st == 0]
-                else:
-                    step_ids = (
-                        [self.state[target_step]]
-                        if self.state[target_step] == 0
-                        else []
-                    )
-                messages = self.step_ids_to_led_messages(step_ids)
+        messages = []
+        if self.led_mode == LedMode.handled:
+            if target_step is None:
+                step_ids = list(range(len(state)))
+            else:
+                step_ids = [target_step]
+
+            messages = self.step_ids_to_led_messages(step_ids, state)
+        elif self.led_mode == LedMode.partial_handled:
+            # only note-offs
+            if target_step is None:
+                step_ids = [st for st in state if st == 0]
+            else:
+                step_ids = (
+                    [state[target_step]]
+                    if state[target_step] == 0
+                    else []
+                )
+            messages = self.step_ids_to_led_messages(step_ids, state)
 
+        return messages
+
+    def propagate(self, target_step=None):
+        if self.displayed():
+            messages = self.led_messages(target_step)
             if len(messages):
                 # print("Sending led message", messages)
                 self.led_queue(messages)
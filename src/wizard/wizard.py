@@ -272,14 +272,14 @@ def load_config(conf_path):
     return config
 
 
-def main(overwrite=False):
+def main(overwrite=False, backend=None):
     print(_HELP_STR_)
     print(
         "You will now be prompted to select MIDI I/O for your controller.\n"
         "Don't select to create virtual ports!"
     )
 
-    ctrl = open_controller()
+    ctrl = open_controller(backend=backend)
     midiin, midiout = ctrl["input_port"], ctrl["output_port"]
     portname = ctrl["input_name"]
     conf_path = search_controller_config(portname)
@@ -0,0 +1,62 @@
+import time
+from pathlib import Path
+
+from rtmidi.midiconstants import (
+    NOTE_ON, SONG_START, SONG_STOP, TIMING_CLOCK
+)
+
+from main import load_config, setup, start, shutdown
+from ports import LoopbackBackend, SimulatedController
+from framebuffer import LedSysEx
+
+
+CONTROLLER = (
+    Path(__file__).resolve().parents[1] / "controllers" / "launchpad_x.yaml"
+)
+
+
+def wait_for(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.005)
+
+    return predicate()
+
+
+def test_pad_press_plays_on_loopback_output():
+    config = load_config(CONTROLLER)
+    backend = LoopbackBackend()
+    sim = SimulatedController(
+        backend, sysex=LedSysEx.from_config(config["led_config"])
+    )
+    synth_in, _ = backend.open_input("synth")
+    notes = []
+    synth_in.set_callback(lambda event, data: notes.append(event[0]))
+    clock_out, _ = backend.open_output("clock")
+
+    app = setup(
+        config, sim.input_name, sim.output_name, "synth", "clock",
+        backend=backend,
+    )
+    start(app)
+    try:
+        # first step of the displayed track
+        pad = config["note_input_map"][0]
+        sim.press(pad)
+        assert wait_for(lambda: sim.lit(pad))
+
+        # a bar of the external clock
+        clock_out.send_message([SONG_START])
+        for _ in range(4 * 24):
+            clock_out.send_message([TIMING_CLOCK])
+        clock_out.send_message([SONG_STOP])
+
+        note = app["sequencer"].note_output_map[0]
+        assert wait_for(lambda: any(
+            message[0] & 0xF0 == NOTE_ON
+            and message[1] == note
+            and message[2] > 0
+            for message in notes
+        )), notes
+    finally:
+        shutdown(app)